@@ -1,11 +1,13 @@
-from pylablib.devices import Andor
-
-from threading import Event
+import time
+from threading import Event, Condition
+from collections import deque
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QObject
 
 import numpy as np
 import cv2
 
+import Instrumentation as instr
+
 
 class AndorCCD(QObject):
     # Values from Andor SDK documentation
@@ -15,7 +17,8 @@ class AndorCCD(QObject):
 
     connStatus = False
 
-    frameAcquired = pyqtSignal(np.ndarray)
+    # index of the frame slot in the FrameProvider ring buffer
+    frameAcquired = pyqtSignal(int)
 
     def __init__(self, config, params):
         super().__init__()
@@ -23,13 +26,19 @@ class AndorCCD(QObject):
         self.conf = config
 
         try:
-            self.cam = Andor.AndorSDK2Camera(temperature='off')
+            if self.conf['backend'] == 'sim':
+                from Simulators import SimAndorCamera
+                self.cam = SimAndorCamera(self.conf)
+            else:
+                from pylablib.devices import Andor
+                self.cam = Andor.AndorSDK2Camera(temperature='off')
             # print(self.cam.get_device_info())
             if self.cam.is_opened():
                 self.connStatus = True
 
             # self.frameProvider = FrameProvider(self.cam, self.ccdData, self.frameAcquired)
-            self.frameProvider = FrameProvider(self.cam, self.frameAcquired)
+            self.frameRing = FrameRing(self.conf['ringSlots'], self.conf['CCD-h'], self.conf['CCD-w'])
+            self.frameProvider = FrameProvider(self.cam, self.frameRing, self.frameAcquired)
             self.frameProvider.start()
 
             self.set_exposure(params['exposure'])
@@ -50,6 +59,51 @@ class AndorCCD(QObject):
         if self.connStatus:
             self.frameProvider.acquire_frame()
 
+    def stop_acquisition(self):
+        if self.connStatus:
+            self.frameProvider.stop_acquisition()
+
+    def wait_exposure(self, timeout=None):
+        # blocks until the exposure of the first frame of the current acquisition is over
+        if self.connStatus:
+            return self.frameProvider.exposure_done.wait(timeout)
+        else:
+            return True
+
+    def wait_idle(self, timeout=None):
+        # blocks until the current acquisition, finished or aborted, has left the FrameProvider
+        if self.connStatus:
+            return self.frameProvider.idle.wait(timeout)
+        else:
+            return True
+
+    def frame_timeout(self):
+        # longest wait for one frame of the current acquisition
+        return self.frameProvider.frame_timeout(self.cam.get_frame_timings()) if self.connStatus else 0
+
+    def frame_timings(self):
+        # exposure, accumulation cycle and kinetic cycle times (sec) of the current settings
+        if self.connStatus:
+            return self.cam.get_frame_timings()
+        else:
+            return False
+
+    def frame_time(self, idx):
+        # time.perf_counter() at the middle of the frame exposure
+        return self.frameRing.stamps[idx]
+
+    def frame_data(self, idx):
+        # view onto the ring buffer slot, valid until release_frame(idx)
+        return self.frameRing.view(idx)
+
+    def claim_frame(self, idx):
+        # has to be called from a frameAcquired slot with a direct connection,
+        # frames nobody has claimed are released as soon as the signal returns
+        self.frameRing.claim(idx)
+
+    def release_frame(self, idx):
+        self.frameRing.release(idx)
+
     def set_temperature(self, t):
         if self.connStatus:
             self.cam.set_temperature(t)
@@ -88,10 +142,21 @@ class AndorCCD(QObject):
         mode = self.ACQ_MODE[acqParams['mode']]
 
         if self.connStatus:
+            if mode == 'kinetic':
+                self.frameProvider.set_series(acqParams['kSeries'], acqParams['accumFrames'])
+            elif mode == 'fast_kinetic':
+                self.frameProvider.set_series(acqParams['kSeries'])
+            elif mode == 'cont':
+                self.frameProvider.set_series(0)
+            elif mode == 'accum':
+                self.frameProvider.set_series(1, acqParams['accumFrames'])
+            else:
+                self.frameProvider.set_series(1)
+
             if mode == 'single':
                 return self.cam.set_acquisition_mode(mode, setup_params=False)
             elif mode == 'accum':
-                return self.cam.setup_accum_mode(mode, acqParams['accumCycle'])
+                return self.cam.setup_accum_mode(acqParams['accumFrames'], acqParams['accumCycle'])
             elif mode == 'kinetic':
                 return self.cam.setup_kinetic_mode(acqParams['kSeries'], acqParams['kCycle'], acqParams['accumFrames'], acqParams['accumCycle'])
             elif mode == 'fast_kinetic':
@@ -146,30 +211,106 @@ class AndorCCD(QObject):
             self.connStatus = False
 
 
+class FrameRing(object):
+    # Preallocated CCD frame slots shared between FrameProvider and the frame consumers.
+    # Every slot holds a reference count: the producer holds a slot from acquire() until the frame is
+    # delivered, each consumer from claim() until its release(). A slot goes back to the free list when
+    # the last reference is released, so a held slot is never handed out again whatever the order of
+    # the releases. The producer blocks when no slot is free.
+
+    def __init__(self, slots, height, width):
+        self.slots = slots
+        self.frames = np.zeros((slots, height, width), dtype=np.uint16)
+        self.stamps = np.zeros(slots)
+        self.refs = np.zeros(slots, dtype=np.int64)
+
+        self._free = deque(range(slots))
+        self._cond = Condition()
+
+    def acquire(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                return None
+
+            idx = self._free.popleft()
+            self.refs[idx] = 1
+            return idx
+
+    def claim(self, idx):
+        with self._cond:
+            if self.refs[idx] == 0:
+                raise ValueError('Frame slot {} is not in use'.format(idx))
+            self.refs[idx] += 1
+
+    def release(self, idx):
+        with self._cond:
+            if self.refs[idx] == 0:
+                raise ValueError('Frame slot {} is already free'.format(idx))
+
+            self.refs[idx] -= 1
+            if self.refs[idx] == 0:
+                self._free.append(idx)
+                self._cond.notify()
+
+    def view(self, idx):
+        return self.frames[idx]
+
+
 class FrameProvider(QThread):
 
     timeout = 5.0
 
+    # frames per acquisition: 1 - single/accumulate, N - kinetic series, 0 - continuous
+    series = 1
+    # accumulated exposures per frame
+    accum = 1
+
+    # sec added to the kinetic cycle for the wait on a frame of a series
+    cycleMargin = 0.8
+
     acquisition = Event()
+    exposure_done = Event()
+    idle = Event()
+    abort_event = Event()
     stop_event = Event()
 
-    def __init__(self, cam, frame_acquired):
+    def __init__(self, cam, ring, frame_acquired):
         super().__init__()
 
         self.cam = cam
+        self.ring = ring
         # self.frameData = frame_data
 
         self.frameAcquired = frame_acquired
+        self.idle.set()
 
     def set_timeout(self, exp_time, frequency):
         # 261120 - number of pixels
         # 0.8 sec - data transfer time
         self.timeout = exp_time + 1.2 * 261120 / frequency + 0.8
 
+    def set_series(self, n, accum=1):
+        self.series = n
+        self.accum = accum
+
+    def frame_timeout(self, timings):
+        # frames of a series come one kinetic cycle apart, which may be longer than exposure and readout
+        if self.series == 1:
+            return self.timeout
+
+        return max(self.timeout, timings.kinetic) + self.cycleMargin
+
     def acquire_frame(self):
+        self.abort_event.clear()
+        self.exposure_done.clear()
+        self.idle.clear()
         self.acquisition.set()
 
+    def stop_acquisition(self):
+        self.abort_event.set()
+
     def stop(self):
+        self.abort_event.set()
         self.stop_event.set()
 
     def frame_template(self):
@@ -180,14 +321,61 @@ class FrameProvider(QThread):
 
         return np.dot(data[..., :3], [0.2989, 0.5870, 0.1140]).astype(np.uint16)
 
+    def free_slot(self):
+        # backpressure: wait until the consumer hands a slot back
+        while not self.abort_event.is_set():
+            idx = self.ring.acquire(timeout=0.5)
+            if idx is not None:
+                return idx
+
+        return None
+
+    def put_frame(self, frame_data, stamp):
+        with instr.span('ccd.backpressure'):
+            idx = self.free_slot()
+        if idx is not None:
+            self.ring.frames[idx] = frame_data
+            self.ring.stamps[idx] = stamp
+            # directly connected consumers run inside emit(), the ones that claimed the slot release it later
+            with instr.span('ccd.deliver'):
+                self.frameAcquired.emit(idx)
+            self.ring.release(idx)
+
+    def read_series(self):
+        timings = self.cam.get_frame_timings()
+        exposure = timings.exposure + (self.accum - 1) * timings.accum
+
+        timeout = self.frame_timeout(timings)
+
+        self.cam.start_acquisition()
+        t_start = time.perf_counter()
+        try:
+            # the shutter closes once the first exposure is over, readout is still in progress
+            self.abort_event.wait(exposure)
+            self.exposure_done.set()
+
+            n = 0
+            while (self.series == 0 or n < self.series) and not self.abort_event.is_set():
+                with instr.span('ccd.wait_frame'):
+                    self.cam.wait_for_frame(timeout=timeout)
+                with instr.span('ccd.read'):
+                    frame = self.cam.read_oldest_image()
+                # frames are timestamped from the acquisition start and the kinetic cycle
+                self.put_frame(frame, t_start + n * timings.kinetic + exposure / 2)
+                n += 1
+        finally:
+            self.cam.stop_acquisition()
+
     def run(self):
         while not self.stop_event.is_set():
             if self.acquisition.wait(0.5):
                 self.acquisition.clear()
                 # frameData = self.frame_template()
                 try:
-                    frameData = self.cam.snap(timeout=self.timeout)
-                    self.frameAcquired.emit(frameData)
+                    self.read_series()
                 except self.cam.Error:
                     print('CCD frame acquisition error')
+                finally:
+                    self.exposure_done.set()
+                    self.idle.set()
         return
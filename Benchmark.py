@@ -0,0 +1,368 @@
+import sys
+import json
+import time
+import argparse
+from threading import Event
+
+from PyQt5.QtCore import Qt, QCoreApplication, QObject, QThreadPool, QMutex, pyqtSignal
+
+import numpy as np
+
+from HardWareController import HardWare
+from AndorController import AndorCCD
+from SpectraModule import SpectrumCompilation
+from ScanModule import ScanExecutor
+from ScanPlan import ScanPlan
+from SpectrumCube import SpectrumCube
+from DataWriter import DataWriter
+import Instrumentation as instr
+
+
+# Headless acquisition benchmark against the simulated hardware (see Simulators.py).
+# Every scenario reports wall time, throughput, latency percentiles and the overhead: everything
+# except the exposure. 'software' is the time on top of what the simulated devices need
+# (readout, grating and stage motion), i.e. the cost of our own code paths.
+#
+#   python Benchmark.py [--scenarios single kinetic ...] [--repeat N] [--output result.json]
+#
+# The exit status is 1 if any result is over its budget.
+
+SCENARIOS = ('single', 'accumulate', 'kinetic', 'stitched', 'mono', 'scan')
+
+# upper limits (sec) of the p90 values
+BUDGETS = {
+    'single': {'software_p90': 0.05},
+    'accumulate': {'software_p90': 0.05},
+    'kinetic': {'software_p90': 0.05},
+    'stitched': {'readout_p90': 0.3, 'stitch_p90': 0.05},
+    'mono': {'latency_p90': 0.02},
+    'scan': {'software_p90': 0.1},
+}
+
+
+def stats(values):
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return {}
+
+    return {
+        'n': int(values.size),
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max())
+    }
+
+
+class SpectraBench(QObject):
+    # the parts of SpectraModule used by SpectrumCompilation and ScanExecutor
+
+    spectrumAcquired = pyqtSignal()
+    stripAcquired = pyqtSignal(int)
+    acquisitionTimings = pyqtSignal(dict)
+
+    spectraOverlap = 80
+
+    def __init__(self, hardware, ccd, param_set):
+        super().__init__()
+
+        self.hardware = hardware
+        self.ccd = ccd
+        self.paramSet = param_set
+        self.mutex = QMutex()
+        self.dataWriter = DataWriter()
+
+        self.ccdWidth = ccd.conf['CCD-w']
+        self.ccdHeight = ccd.conf['CCD-h']
+        self.spCube = SpectrumCube(self.ccdHeight, self.ccdWidth)
+
+        self.timings = []
+        self.acquisitionTimings.connect(self.timings.append, Qt.DirectConnection)
+
+        self.spectrumCmp = SpectrumCompilation(self)
+        self.spectrumCmp.setAutoDelete(False)
+        self.set_strips(1)
+
+    def set_strips(self, strips):
+        positions, axes, WL_end = self.hardware.plan_strip_positions(
+            self.paramSet['MDR-3']['WL-start'], overlap_px=self.spectraOverlap, strips=strips)
+
+        self.spCube.resize((self.ccdWidth - self.spectraOverlap) * strips + self.spectraOverlap)
+        self.spectrumCmp.set_frame_size(self.spCube.frame(), self.ccdWidth, self.spectraOverlap)
+        self.spectrumCmp.set_range_points(positions)
+
+        # the grating is parked at the first strip, so the runs only include the moves between strips
+        self.hardware.mono_goto(positions[0])
+        while self.hardware.mono_status() == 'BUSY':
+            time.sleep(0.01)
+
+    def acquire_wait(self, timeout=None):
+        self.spectrumCmp.saving = False
+        self.spectrumCmp.active.set()
+        self.spectrumCmp.done.clear()
+        QThreadPool.globalInstance().start(self.spectrumCmp)
+        return self.spectrumCmp.done.wait(timeout)
+
+
+class ScanBench(object):
+    # the parts of ScanModule used by ScanExecutor
+
+    def __init__(self, spectra):
+        self.hardware = spectra.hardware
+        self.spectraModule = spectra
+        self.dataWriter = DataWriter()
+        self.scanCube = None
+
+
+class Benchmark(object):
+
+    def __init__(self, hardware_conf, param_set, exposure, repeat):
+        self.hardware = HardWare(hardware_conf)
+        self.ccd = AndorCCD(hardware_conf['Andor'], param_set['Andor'])
+        self.paramSet = param_set
+        self.exposure = exposure
+        self.repeat = repeat
+
+        self.ccd.set_exposure(exposure)
+        self.spectra = SpectraBench(self.hardware, self.ccd, param_set)
+
+        self.received = []
+        self.expected = 0
+        self.complete = Event()
+        self.listening = False
+        self.ccd.frameAcquired.connect(self.frame_handler, Qt.DirectConnection)
+
+    def frame_handler(self, slot):
+        # FrameProvider thread
+        if self.listening:
+            self.received.append((time.perf_counter(), self.ccd.frame_time(slot)))
+            if len(self.received) >= self.expected:
+                self.complete.set()
+
+    def frames(self, acq_params, frames):
+        # single / accumulate / kinetic acquisitions through FrameProvider
+        self.ccd.set_acq_mode(acq_params)
+        timings = self.ccd.frame_timings()
+        accum = acq_params['accumFrames'] if acq_params['mode'] in (1, 2) else 1
+        exposure = timings.exposure + (accum - 1) * timings.accum
+        # time the simulated CCD needs for the whole acquisition
+        device = (frames - 1) * timings.kinetic + exposure + self.ccd.cam.readout_time()
+
+        walls, latencies = [], []
+        self.listening = True
+        for i in range(self.repeat):
+            self.received = []
+            self.expected = frames
+            self.complete.clear()
+
+            t = time.perf_counter()
+            self.ccd.frame()
+            if not self.complete.wait(device + self.ccd.frame_timeout()):
+                break
+            walls.append(time.perf_counter() - t)
+
+            # from the end of the exposure to the frame delivery: readout and handoff
+            latencies += [received - (stamp + exposure / 2) for received, stamp in self.received]
+        self.listening = False
+
+        walls = np.array(walls)
+        return {
+            'frames': frames,
+            'exposure': frames * accum * timings.exposure,
+            'wall': stats(walls),
+            'throughput': frames * len(walls) / walls.sum() if walls.size else 0.0,
+            'latency': stats(latencies),
+            'overhead': stats(walls - frames * accum * timings.exposure),
+            'software': stats(walls - device)
+        }
+
+    def stitched(self, strips):
+        self.ccd.set_acq_mode(dict(self.paramSet['Andor']['AcqMode'], mode=0))
+        self.spectra.set_strips(strips)
+
+        self.spectra.timings.clear()
+        for i in range(self.repeat):
+            self.spectra.acquire_wait()
+
+        runs = self.spectra.timings
+        strip_timings = [t for run in runs for t in run['strips']]
+        totals = np.array([run['total'] for run in runs])
+        exposure = np.array([sum(t['exposure'] for t in run['strips']) for run in runs])
+
+        return {
+            'strips': strips,
+            'wall': stats(totals),
+            'throughput': len(strip_timings) / totals.sum() if totals.size else 0.0,
+            'overhead': stats(totals - exposure),
+            'move': stats([t['move'] for t in strip_timings]),
+            'readout': stats([t['readout'] for t in strip_timings]),
+            'stitch': stats([t['stitch'] for t in strip_timings])
+        }
+
+    def mono(self):
+        # command round trips and a grating move
+        latencies = {}
+        for cmd in ('DS', 'GP'):
+            lat = []
+            for i in range(20 * self.repeat):
+                t = time.perf_counter()
+                self.hardware.mono.request(cmd)
+                lat.append(time.perf_counter() - t)
+            latencies[cmd] = lat
+
+        pos = self.hardware.mono_pos()
+        distance = 200
+        moves = []
+        for i in range(self.repeat):
+            target = pos + distance if i % 2 == 0 else pos
+            t = time.perf_counter()
+            self.hardware.mono_goto(target)
+            while self.hardware.mono_status() == 'BUSY':
+                time.sleep(0.005)
+            moves.append(time.perf_counter() - t)
+
+        device = distance / self.hardware.conf['MDR']['simSpeed']
+        return {
+            'latency': stats(latencies['DS'] + latencies['GP']),
+            'DS': stats(latencies['DS']),
+            'GP': stats(latencies['GP']),
+            'move': stats(moves),
+            'software': stats(np.array(moves) - device)
+        }
+
+    def scan(self, counts, step):
+        # X/Y map with a spectrum acquisition at every point
+        self.ccd.set_acq_mode(dict(self.paramSet['Andor']['AcqMode'], mode=0))
+        self.spectra.set_strips(1)
+
+        plan = ScanPlan([{'id': 1, 'count': counts[0], 'step': step}, {'id': 2, 'count': counts[1], 'step': step}])
+        plan.set_order('serpentine')
+
+        scan_module = ScanBench(self.spectra)
+        scan_module.scanCube = SpectrumCube(self.spectra.ccdHeight, self.spectra.spCube.width, plan.counts)
+        executor = ScanExecutor(scan_module)
+        executor.setup(plan, [{'id': 1, 'use': 2}])
+
+        stamps = []
+        executor.pointDone.connect(lambda idx, value: stamps.append(time.perf_counter()), Qt.DirectConnection)
+
+        t = time.perf_counter()
+        executor.run()
+        wall = time.perf_counter() - t
+
+        # stage moves between the points and the spectrum acquisitions
+        velocity, acceleration = self.hardware.stage_motion_params()
+        motion = plan.estimate(self.hardware.minStageStep, velocity, acceleration)['time']
+        per_point = np.diff([t] + stamps)
+        acquisition = np.array([run['total'] for run in self.spectra.timings[-len(plan):]])
+        device = self.ccd.frame_timings().exposure + self.ccd.cam.readout_time()
+
+        return {
+            'points': len(plan),
+            'wall': wall,
+            'throughput': len(plan) / wall,
+            'point': stats(per_point),
+            'motion': motion,
+            'overhead': stats(per_point - self.ccd.frame_timings().exposure),
+            'software': stats(acquisition - device)
+        }
+
+    def run(self, scenarios):
+        acq = self.paramSet['Andor']['AcqMode']
+        results = {}
+        for name in scenarios:
+            if name == 'single':
+                results[name] = self.frames(dict(acq, mode=0), 1)
+            elif name == 'accumulate':
+                results[name] = self.frames(dict(acq, mode=1, accumFrames=3, accumCycle=0), 1)
+            elif name == 'kinetic':
+                results[name] = self.frames(dict(acq, mode=2, kSeries=5, kCycle=0, accumFrames=1), 5)
+            elif name == 'stitched':
+                results[name] = self.stitched(4)
+            elif name == 'mono':
+                results[name] = self.mono()
+            elif name == 'scan':
+                results[name] = self.scan((3, 3), 200)
+
+        return results
+
+    def shut_down(self):
+        self.spectra.spectrumCmp.stop()
+        self.ccd.frameProvider.stop()
+        self.ccd.frameProvider.wait()
+        self.ccd.shut_down()
+        self.hardware.shut_down()
+
+
+def check_budgets(results, budgets):
+    report = {}
+    for name, limits in budgets.items():
+        if name not in results:
+            continue
+
+        report[name] = {}
+        for key, limit in limits.items():
+            metric, stat = key.rsplit('_', 1)
+            value = results[name][metric].get(stat, 0.0)
+            report[name][key] = {'value': value, 'budget': limit, 'ok': value <= limit}
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Acquisition benchmark on simulated hardware')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--exposure', type=float, default=0.05)
+    parser.add_argument('--budgets', help='JSON file with budgets replacing the defaults')
+    parser.add_argument('--output', help='JSON result file, stdout by default')
+    parser.add_argument('--spans', action='store_true', help='add the instrumentation span statistics')
+    args = parser.parse_args()
+
+    instr.enable(args.spans)
+
+    app = QCoreApplication(sys.argv)
+
+    with open('hardware-config.json', 'r') as f:
+        hardware_conf = json.load(f)
+    with open('default-params.json', 'r') as f:
+        param_set = json.load(f)
+
+    for dev in ('Andor', 'Thorlabs', 'MDR'):
+        hardware_conf[dev]['backend'] = 'sim'
+
+    budgets = BUDGETS
+    if args.budgets:
+        with open(args.budgets, 'r') as f:
+            budgets = json.load(f)
+
+    bench = Benchmark(hardware_conf, param_set, args.exposure, args.repeat)
+    try:
+        results = bench.run(args.scenarios)
+    finally:
+        bench.shut_down()
+
+    report = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'exposure': args.exposure,
+        'repeat': args.repeat,
+        'results': results,
+        'budgets': check_budgets(results, budgets)
+    }
+    if args.spans:
+        report['spans'] = instr.snapshot()
+
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out)
+    else:
+        print(out)
+
+    ok = all(check['ok'] for checks in report['budgets'].values() for check in checks.values())
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
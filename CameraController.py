@@ -1,10 +1,16 @@
+import os
 import time
-from threading import Event
+from contextlib import ExitStack
+from threading import Event, Lock
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QObject
 
 import cv2
 import numpy as np
 
+# vimba drops its per-call tracing and argument type checks in production mode. The decorators are
+# applied on import, VIMBA_PY_PRODUCTION=0 in the environment keeps them for debugging.
+os.environ.setdefault('VIMBA_PY_PRODUCTION', '1')
+
 from vimba import *
 
 
@@ -18,6 +24,9 @@ class Cam(QObject):
     imageHeight = 100
     imageChannel = 1
 
+    # Frames from the stream thread arrive on streamFrame and are dispatched to the frameAcquired
+    # receivers in the GUI thread. The driver buffer is released once, after all of them are done.
+    streamFrame = pyqtSignal(np.ndarray)
     frameAcquired = pyqtSignal(np.ndarray)
     devStarted = pyqtSignal()
 
@@ -25,6 +34,7 @@ class Cam(QObject):
         super().__init__()
 
         self.capDevices = self.test_devices()
+        self.streamFrame.connect(self.dispatch_frame)
         # self.camImg = np.zeros((self.imageHeight, self.imageWidth, self.imageChannel), np.ubyte)
 
     def test_devices(self):
@@ -65,6 +75,9 @@ class Cam(QObject):
         return devices
 
     def connect(self, dev):
+        # the previous device holds its camera open until disconnected
+        self.disconnect()
+
         if len(self.capDevices) > 0:
             if dev > len(self.capDevices)-1:
                 dev = 0
@@ -73,9 +86,9 @@ class Cam(QObject):
             provider = self.capDevices[dev]['provider']
 
             if provider == 'vimba':
-                self.ctrl = VimbaCam(dev_id, self.frameAcquired, self.devStarted)
+                self.ctrl = VimbaCam(dev_id, self.streamFrame, self.devStarted)
             elif provider == 'opencv':
-                self.ctrl = OpencvCam(dev_id, self.frameAcquired, self.devStarted)
+                self.ctrl = OpencvCam(dev_id, self.streamFrame, self.devStarted)
             else:
                 return False, dev
 
@@ -88,12 +101,25 @@ class Cam(QObject):
         else:
             return False, dev
 
+    def dispatch_frame(self, frame):
+        # receivers are called directly and must not keep the frame, copy what is needed
+        try:
+            self.frameAcquired.emit(frame)
+        finally:
+            self.release_frame(frame)
+
+    def release_frame(self, frame):
+        if self.ctrl is not None:
+            self.ctrl.release_frame(frame)
+
     def disconnect(self):
         if self.ctrl is not None:
             self.ctrl.disconnect()
 
 
 class VimbaCam(QObject):
+    # Vimba and the camera stay open from connect to disconnect. Features are discovered once, nested
+    # 'with self.cap' blocks and feature writes from the controls do not reopen the camera.
 
     connStatus = False
     streaming = False
@@ -104,20 +130,23 @@ class VimbaCam(QObject):
         self.frameAcquiredSig = frame_acquired
         self.devStartedSig = dev_started
 
-        with Vimba.get_instance() as vimba:
-            try:
-                self.cap = vimba.get_camera_by_id(dev_id)
-                self.connStatus = True
-            except VimbaCameraError:
-                print('Failed to access Camera. Abort.')
+        self.session = ExitStack()
+        vimba = self.session.enter_context(Vimba.get_instance())
+        try:
+            self.cap = vimba.get_camera_by_id(dev_id)
+            self.session.enter_context(self.cap)
+            self.connStatus = True
+        except VimbaCameraError:
+            print('Failed to access Camera. Abort.')
+            self.session.close()
 
-            if self.connStatus:
-                self.camThread = VimbaStream(self.cap, self.frameAcquiredSig, self.devStartedSig)
+        if self.connStatus:
+            self.camThread = VimbaStream(self.cap, self.frameAcquiredSig, self.devStartedSig)
 
-                # Setup camera.
-                self.setup_camera(self.cap)
-                # Set pixel format
-                self.pixel_format(self.cap)
+            # Setup camera.
+            self.setup_camera(self.cap)
+            # Set pixel format
+            self.pixel_format(self.cap)
 
     def setup_camera(self, cam: Camera):
         with cam:
@@ -165,49 +194,32 @@ class VimbaCam(QObject):
         makoG234_DR = 6
         makoG234_auto_range = 100
 
-        if self.connStatus:
-            if auto_adjust:
-                target_val = round(exposure * makoG234_auto_range)  # integer 0..100
-                with self.cap:
-                    try:
-                        return self.cap.ExposureAutoTarget.set(target_val)
-                    except:
-                        return False
-            else:
-                exp_val = round(makoG234_min_exposure * pow(10, exposure * makoG234_DR))  # in us
-                with self.cap:
-                    try:
-                        return self.cap.ExposureTimeAbs.set(exp_val)
-                    except:
-                        return False
+        if auto_adjust:
+            target_val = round(exposure * makoG234_auto_range)  # integer 0..100
+            return self.set_features({'ExposureAutoTarget': target_val})
         else:
-            return False
+            exp_val = round(makoG234_min_exposure * pow(10, exposure * makoG234_DR))  # in us
+            return self.set_features({'ExposureTimeAbs': exp_val})
 
     def set_gain(self, gain):
         # gain: float, range 0..1
 
         makoG234_max_gain = 40
 
-        if self.connStatus:
-            g_val = round(gain * makoG234_max_gain, 1)
-            with self.cap:
-                try:
-                    return self.cap.Gain.set(g_val)
-                except:
-                    return False
-        else:
-            return False
+        g_val = round(gain * makoG234_max_gain, 1)
+        return self.set_features({'Gain': g_val})
 
     def set_auto_exposure(self, set_auto=False):
+        return self.set_features({'ExposureAuto': 'Continuous' if set_auto else 'Off'})
+
+    def set_features(self, features):
+        # several feature writes in the open camera, in the given order
         if self.connStatus:
-            with self.cap:
-                try:
-                    if set_auto:
-                        return self.cap.ExposureAuto.set('Continuous')
-                    else:
-                        return self.cap.ExposureAuto.set('Off')
-                except:
-                    return False
+            try:
+                self.cap.set_features(features)
+                return True
+            except (VimbaFeatureError, RuntimeError, TypeError, ValueError):
+                return False
         else:
             return False
 
@@ -225,16 +237,29 @@ class VimbaCam(QObject):
 
         return self.streaming
 
+    def release_frame(self, frame):
+        if self.connStatus:
+            self.camThread.release(frame)
+
     def disconnect(self):
         if self.streaming:
             self.stop_streaming()
+            self.camThread.wait(2000)
+
+        if self.connStatus:
+            self.session.close()
 
         self.connStatus = False
 
 
 class VimbaStream(QThread):
+    # Complete frames are emitted as views on the driver buffers, without a copy. The buffer is owned by
+    # the receiver and goes back to the driver queue on release(), so it is not overwritten while shown.
+    # At most maxPending frames are held, newer frames are requeued at once while the display lags.
 
-    stop_event = Event()
+    maxPending = 2
+    # time (ms) a frame stays out of the driver queue until displayed, sizes the buffer count
+    holdTime = 150
 
     def __init__(self, cap, frame_acquired, stream_started):
         super().__init__()
@@ -242,17 +267,46 @@ class VimbaStream(QThread):
         self.frameAcquired = frame_acquired
         self.streamStarted = stream_started
 
+        # per stream, a stopped device must not stop the next one
+        self.stop_event = Event()
+
+        self.pending = []
+        self.pendingLock = Lock()
+
     def frame_handler(self, cam: Camera, frame: Frame):
         if frame.get_status() == FrameStatus.Complete:
-            self.frameAcquired.emit(frame.as_opencv_image())
+            with self.pendingLock:
+                if len(self.pending) < self.maxPending:
+                    image = frame.as_opencv_image()
+                    self.pending.append((image, frame))
+                    self.frameAcquired.emit(image)
+                    return
 
         cam.queue_frame(frame)
 
+    def release(self, image):
+        with self.pendingLock:
+            for i, (img, frame) in enumerate(self.pending):
+                if img is image:
+                    del self.pending[i]
+                    break
+            else:
+                return
+
+        try:
+            self.cap.queue_frame(frame)
+        except (RuntimeError, ValueError, VimbaCameraError):
+            # streaming has been stopped, the frame is no longer announced
+            pass
+
     def run(self):
+        with self.pendingLock:
+            self.pending.clear()
+
         with Vimba.get_instance():
             with self.cap:
                 try:
-                    self.cap.start_streaming(self.frame_handler, buffer_count=5)
+                    self.cap.start_streaming(self.frame_handler, buffer_count=None, handler_latency_ms=self.holdTime)
                     self.streamStarted.emit()
                     self.stop_event.wait()
                     return
@@ -344,6 +398,10 @@ class OpencvCam(QObject):
 
         return self.streaming
 
+    def release_frame(self, frame):
+        # frames are read into new arrays, nothing to return
+        pass
+
     def disconnect(self):
         if self.streaming:
             self.stop_streaming()
@@ -355,8 +413,6 @@ class OpencvCam(QObject):
 
 class OpencvStream(QThread):
 
-    stop_event = Event()
-
     def __init__(self, cap, frame_acquired, stream_started):
         super().__init__()
 
@@ -365,6 +421,8 @@ class OpencvStream(QThread):
         self.frameAcquired = frame_acquired
         self.streamStarted = stream_started
 
+        self.stop_event = Event()
+
     def run(self):
         self.streamStarted.emit()
         while not self.stop_event.is_set():
@@ -12,6 +12,7 @@ import numpy as np
 import re
 import cv2
 from WidgetsUI import PgGraphicsView
+import Instrumentation as instr
 
 
 class CamWI(QFrame):
@@ -30,6 +31,10 @@ class CamWI(QFrame):
 
     alpha = 0.4
 
+    # reusable display buffers, frames are converted and flipped into them without allocation
+    dispBuf = None
+    convBuf = None
+
     def __init__(self, cam, p_set, activate):
         super().__init__()
 
@@ -180,47 +185,65 @@ class CamWI(QFrame):
             except:
                 pass
 
+    @instr.timed('render.camera')
     def update_frame(self, frame):
+        # the frame buffer belongs to the camera driver and is released by Cam after all widgets are done,
+        # it is only read here - primitives are drawn into the display buffer
         if self.active:
+            image = self.display_frame(frame)
             if self.addPrimitives:
-                frame = self.draw_primitives(frame)
-
-            if self.cam.imageChannel == 3:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                self.draw_primitives(image)
 
-            self.camFrame.image.setImage(self.frame_transform(frame, vInvert=True), autoLevels=False)
+            self.camFrame.image.setImage(image, autoLevels=False)
 
         if self.saveFrame:
             self.saveFrame = False
             filename = path.join(self.path, str(self.file_idx).zfill(4) + '.png')
 
-            frame = self.frame_transform(frame, vInvert=False)
-            if self.cam.imageChannel == 3:
-                return cv2.imwrite(filename, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            else:
-                return cv2.imwrite(filename, frame)
+            return cv2.imwrite(filename, self.frame_transform(frame, vInvert=False))
+
+    def display_frame(self, frame):
+        # BGR -> RGB and flip into the display buffer, through convBuf when both are needed
+        shape = frame.shape[:2] if frame.ndim == 3 and frame.shape[2] == 1 else frame.shape
+        if self.dispBuf is None or self.dispBuf.shape != shape or self.dispBuf.dtype != frame.dtype:
+            self.dispBuf = np.empty(shape, frame.dtype)
+            self.convBuf = np.empty(shape, frame.dtype)
+
+        code = self.flip_code(vInvert=True)
+
+        if frame.ndim == 3 and frame.shape[2] == 3:
+            if code is None:
+                return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.dispBuf)
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.convBuf)
+
+        if code is None:
+            np.copyto(self.dispBuf, frame.reshape(shape))
+            return self.dispBuf
+
+        return cv2.flip(frame, code, dst=self.dispBuf)
 
     def draw_primitives(self, cv_img):
         overlay = cv_img.copy()
         return cv2.addWeighted(overlay, self.alpha, cv_img, 1 - self.alpha, 0, cv_img)
 
-    def frame_transform(self, frame, vInvert=False):
-        # PgGraphicsView inverted image:
-        if vInvert:
-            if self.hFlip and not self.vFlip:
-                frame = cv2.flip(frame, -1)
-            elif self.hFlip:
-                frame = cv2.flip(frame, 1)
-            elif not self.vFlip:
-                frame = cv2.flip(frame, 0)
-        # Default:
+    def flip_code(self, vInvert=False):
+        # cv2.flip code, None if no flip is needed. PgGraphicsView shows the image vertically inverted
+        h_flip = self.hFlip
+        v_flip = self.vFlip != vInvert
+
+        if h_flip and v_flip:
+            return -1
+        elif h_flip:
+            return 1
+        elif v_flip:
+            return 0
         else:
-            if self.hFlip and self.vFlip:
-                frame = cv2.flip(frame, -1)
-            elif self.hFlip:
-                frame = cv2.flip(frame, 1)
-            elif self.vFlip:
-                frame = cv2.flip(frame, 0)
+            return None
+
+    def frame_transform(self, frame, vInvert=False):
+        code = self.flip_code(vInvert)
+        if code is not None:
+            frame = cv2.flip(frame, code)
 
         return frame
 
@@ -4,6 +4,8 @@ import os
 import sys
 import time
 import clr
+from threading import Thread, Lock
+from concurrent.futures import Future
 
 clr.AddReference("System")
 clr.AddReference("thorlabs/Thorlabs.MotionControl.DeviceManagerCLI")
@@ -19,8 +21,58 @@ from Thorlabs.MotionControl.KCube.DCServoCLI import KCubeDCServo
 from Thorlabs.MotionControl.GenericMotorCLI import MotorDirection
 
 
+class MotionWatcher(Thread):
+    # Polls the status of moving KCubes and completes their move futures with the final position.
+    # A move counts as finished once the cube reports it is not moving, after it has been seen
+    # moving or the start grace period has passed (status is not updated instantly after the command).
+
+    poll_interval = 0.02
+    start_grace = 0.2
+
+    def __init__(self):
+        super().__init__(daemon=True)
+
+        self.moves = []
+        self.lock = Lock()
+
+    def watch(self, cube):
+        future = Future()
+        with self.lock:
+            self.moves.append([cube, future, time.perf_counter(), False])
+        return future
+
+    def run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                moves = list(self.moves)
+
+            for move in moves:
+                cube, future, started, seen_moving = move
+                try:
+                    moving = cube.is_moving
+                    if moving:
+                        move[3] = True
+                    elif seen_moving or time.perf_counter() - started > self.start_grace:
+                        future.set_result(cube.position)
+                    else:
+                        continue
+                except Exception as e:
+                    future.set_exception(e)
+
+                if future.done():
+                    with self.lock:
+                        self.moves.remove(move)
+
+
+# guards the creation of the MotionWatcher shared by all cubes
+_watcher_lock = Lock()
+
+
 class CubeController:
     _kCubeDCServoMotor = None
+
+    watcher = None
     def __init__(self, serial_number_num):
         try:
             serial_number = str(serial_number_num)
@@ -44,6 +96,24 @@ class CubeController:
     def move_to(self, position):
         self._kCubeDCServoMotor.MoveTo(Decimal(position), 0)
 
+    def move_steps_async(self, distance):
+        # returns a Future completed with the position when the move is over
+        self.move_steps(distance)
+        return self.move_future()
+
+    def move_to_async(self, position):
+        self.move_to(position)
+        return self.move_future()
+
+    def move_future(self):
+        # moves are started from the scan thread and the orchestrator, only one watcher may be created
+        with _watcher_lock:
+            if CubeController.watcher is None:
+                CubeController.watcher = MotionWatcher()
+                CubeController.watcher.start()
+
+        return CubeController.watcher.watch(self)
+
     def home(self):
         self._kCubeDCServoMotor.Home(0)
 
@@ -56,6 +126,18 @@ class CubeController:
     def shutdown(self):
         self._kCubeDCServoMotor.ShutDown()
 
+    def get_velocity_params(self):
+        # max velocity (mm/s) and acceleration (mm/s^2) of the motor settings
+        params = self._kCubeDCServoMotor.GetVelocityParams()
+        return float(str(params.MaxVelocity)), float(str(params.Acceleration))
+
+    def set_velocity_params(self, velocity, acceleration):
+        self._kCubeDCServoMotor.SetVelocityParams(Decimal(velocity), Decimal(acceleration))
+
+    def get_position_counter(self):
+        # position in device units
+        return int(self._kCubeDCServoMotor.GetPositionCounter())
+
     def get_status(self):
         return self._kCubeDCServoMotor.Status
 
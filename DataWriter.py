@@ -0,0 +1,150 @@
+import json
+import time
+from threading import Thread
+from queue import Queue
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class DataWriter(object):
+    # Streaming HDF5 writer. Data is handed over through a bounded queue and written by a background
+    # thread to chunked, compressed datasets, so acquisition is only blocked when the disk falls behind.
+    #
+    # File layout:
+    #   attrs['paramSet']   - JSON snapshot of the parameter set at file creation
+    #   <group>.attrs       - absolute hardware positions at the start of the spectrum / scan:
+    #                         stage counters (stageX, ...), monochromator steps (mono), grating index
+    #   spectrum/strips     - (n, CCD-h, CCD-w) CCD strips in acquisition order
+    #   spectrum/axis       - (n, CCD-w) wavelength axis of every strip
+    #   spectrum/position   - (n,) monochromator position of every strip
+    #   scan/cube           - (*scan counts, rows, columns) data of every scan point
+    #   scan/axis           - (columns,) wavelength axis of the scan data
+    #   scan/offsets        - (*scan counts, dims) stage/monochromator offsets of every point
+    #   scan/time           - (*scan counts) acquisition time of every point
+    # A scan without dimensions (one point at the current position) has the scan counts (1,).
+
+    compression = 'gzip'
+    compression_level = 4
+
+    def __init__(self, queue_size=32):
+        self.queue = Queue(maxsize=queue_size)
+        self.thread = None
+        self.file = None
+        self.path = ''
+        # set by the writer thread when the file cannot be created, later writes are dropped
+        self.failed = False
+
+        self.scanShape = None
+
+    @staticmethod
+    def available():
+        return h5py is not None
+
+    def is_open(self):
+        return self.thread is not None
+
+    def is_writing(self):
+        return self.is_open() and not self.failed
+
+    def open(self, path, param_set, scan_shape=None):
+        if not self.available():
+            print('h5py is not installed, data is not saved')
+            return False
+
+        self.close()
+
+        self.path = path
+        self.failed = False
+        self.scanShape = tuple(scan_shape) if scan_shape is not None else None
+        self.thread = Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+        self.queue.put(('h5_open', (path, json.dumps(param_set))))
+
+        return True
+
+    def write_positions(self, group, positions):
+        if self.is_writing():
+            self.queue.put(('h5_positions', (group, dict(positions))))
+
+    def write_strip(self, data, axis, position):
+        if self.is_writing():
+            self.queue.put(('h5_strip', (np.array(data), np.array(axis), position)))
+
+    def write_point(self, index, offsets, data, axis):
+        if self.is_writing():
+            self.queue.put(('h5_point', (tuple(index), np.array(offsets), np.array(data), np.array(axis),
+                                         time.time())))
+
+    def close(self):
+        if self.is_open():
+            self.queue.put(('h5_close', ()))
+            self.thread.join()
+            self.thread = None
+
+    def write_loop(self):
+        # the queue is drained until h5_close whatever fails, so writers never block on a full queue
+        while True:
+            op, args = self.queue.get()
+            try:
+                if self.file is not None or op in ('h5_open', 'h5_close'):
+                    getattr(self, op)(*args)
+            except Exception as e:
+                print('Data writer error:', op, e)
+                if self.file is None:
+                    self.failed = True
+
+            if op == 'h5_close':
+                break
+
+    def create(self, name, shape, chunks, dtype, fill=0):
+        maxshape = tuple(None if s == 0 else s for s in shape)
+        return self.file.create_dataset(name, shape=shape, maxshape=maxshape, chunks=chunks, dtype=dtype,
+                                        compression=self.compression, compression_opts=self.compression_level,
+                                        shuffle=True, fillvalue=fill)
+
+    def h5_open(self, path, param_set):
+        self.file = h5py.File(path, 'w')
+        self.file.attrs['paramSet'] = param_set
+        self.file.attrs['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def h5_positions(self, group, positions):
+        self.file.require_group(group).attrs.update(positions)
+
+    def h5_strip(self, data, axis, position):
+        if 'spectrum/strips' not in self.file:
+            self.create('spectrum/strips', (0,) + data.shape, (1,) + data.shape, data.dtype)
+            self.create('spectrum/axis', (0,) + axis.shape, (1,) + axis.shape, np.float64)
+            self.create('spectrum/position', (0,), (64,), np.int64)
+
+        strips = self.file['spectrum/strips']
+        n = strips.shape[0]
+        for name, value in (('spectrum/strips', data), ('spectrum/axis', axis), ('spectrum/position', position)):
+            ds = self.file[name]
+            ds.resize(n + 1, axis=0)
+            ds[n] = value
+
+        self.file.flush()
+
+    def h5_point(self, index, offsets, data, axis, stamp):
+        # a scan without dimensions is stored as a single point, chunked datasets cannot be scalar
+        shape = self.scanShape or (1,)
+        index = index or (0,)
+        if 'scan/cube' not in self.file:
+            self.create('scan/cube', shape + data.shape, (1,) * len(shape) + data.shape, data.dtype)
+            self.create('scan/offsets', shape + offsets.shape, None, np.int64)
+            self.create('scan/time', shape, None, np.float64)
+            self.file['scan/axis'] = axis
+
+        self.file['scan/cube'][index] = data
+        self.file['scan/offsets'][index] = offsets
+        self.file['scan/time'][index] = stamp
+
+    def h5_close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,9 +1,44 @@
 import time
 import re
-import serial
-import serial.tools.list_ports
+import json
+from collections import OrderedDict
 import math
-from CubeController import *
+from concurrent.futures import Future
+import numpy as np
+from MonoController import MonoDriver, discover_mono
+import Instrumentation as instr
+
+
+class AxisCache(object):
+    # LRU cache of precomputed per-strip axis arrays, keyed by (gratingIndex, steps, calibration hash)
+
+    def __init__(self, size=512):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        if key in self._items:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+        else:
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items)}
+
 
 class HardWare(object):
 
@@ -11,11 +46,14 @@ class HardWare(object):
 
     mono = None
     monoStatus = False
+    monoSim = None
 
     gratingIndex = 1
 
     cubes = {}
 
+    calibHash = None
+
 
     def __init__(self, config):
         self.conf = config
@@ -32,46 +70,57 @@ class HardWare(object):
 
         axes = ['X', 'Y', 'Z']
 
-        for axis in axes:
-            self.cubes[axis] = CubeController(self.conf["Thorlabs"]["stage"+axis])
+        # Kinesis .NET assemblies are only loaded for the real stages
+        if self.conf['Thorlabs']['backend'] == 'sim':
+            from Simulators import SimStage
+            for axis in axes:
+                self.cubes[axis] = SimStage(self.conf['Thorlabs'])
+        else:
+            from CubeController import CubeController
+            for axis in axes:
+                self.cubes[axis] = CubeController(self.conf["Thorlabs"]["stage"+axis])
 
         self.minStageStep = self.conf["Thorlabs"]["stageStep"]
 
+        self.axisCache = AxisCache()
+        self.load_calibration()
+
         self.monoStatus, self.mono = self.mono_connect()
 
     def mono_connect(self):
-        connected = False
-        dev = None
-
-        ports = serial.tools.list_ports.comports()
-        for p in ports:
-            if re.search(r'USB-to-Serial', p.description):
-                try:
-                    # print(p.description)
-                    dev = serial.Serial(p.name, 9600, timeout=1)
-                    time.sleep(1)
-
-                    msg = b"DM\n"
-                    # msg = b"G+500"
-                    dev.write(msg)
-                    while dev.out_waiting > 0:
-                        time.sleep(0.1)
-
-                    time.sleep(1)
-                    ans = dev.read(1)
-                    while dev.in_waiting > 0:
-                        ans += dev.read(1)
-
-                    # print(ans.decode("utf-8"))
-                    if re.search(r'Monochromator controller', ans.decode("utf-8")):
-                        connected = True
-                        break
-                    else:
-                        dev.close()
-                except serial.serialutil.SerialException:
-                    pass
-
-        return connected, dev
+        if self.conf['MDR']['backend'] == 'sim':
+            from Simulators import MonoSimulator
+            self.monoSim = MonoSimulator(self.conf['MDR']['simSpeed'])
+            dev = MonoDriver(self.monoSim.port)
+            if not dev.identify():
+                dev.close()
+                dev = None
+        else:
+            dev = discover_mono()
+
+        return dev is not None, dev
+
+    def load_calibration(self):
+        # monochromator calibration constants, cached for the vectorized axis computation
+        mdr = self.conf['MDR']
+        self.calib = {
+            'c': mdr['c'],
+            'k': mdr['k'],
+            'alpha_0': mdr['alpha_0'],
+            'phi_0': mdr['phi_0'],
+            'delta': mdr['DELTA'],
+            'f': mdr['f'],
+            'd': {int(idx): 1 / lines for idx, lines in mdr['grating'].items()}
+        }
+
+        # cached axes become invalid as soon as any of the MDR values change
+        calib_hash = hash(json.dumps(mdr, sort_keys=True))
+        changed = calib_hash != self.calibHash
+        if changed:
+            self.axisCache.clear()
+        self.calibHash = calib_hash
+
+        return changed
 
     def mono_toSteps(self, WL0):
         c = self.conf['MDR']['c']
@@ -82,6 +131,122 @@ class HardWare(object):
 
         return steps
 
+    def mono_toSteps_array(self, WL, n=0, iterations=4):
+        # Inverse of mono_toWL_array: monochromator position which puts wavelength WL on pixel n.
+        # Closed form for the first pixel, refined by Newton iterations on the full model otherwise.
+        cl = self.calib
+        WL = np.asarray(WL, dtype=np.float64)
+        n = np.asarray(n, dtype=np.float64)
+
+        steps = (np.arcsin(WL / cl['c']) - cl['alpha_0']) / cl['k']
+        if np.any(n != 0):
+            for i in range(iterations):
+                steps = steps - (self.mono_toWL_array(steps, n) - WL) / self.mono_dWL_dSteps(steps, n)
+
+        return steps
+
+    def mono_dWL_dSteps(self, steps, n):
+        # derivative of mono_toWL_array with respect to the monochromator position
+        cl = self.calib
+        d = cl['d'][self.gratingIndex]
+        angle = np.asarray(steps, dtype=np.float64) * cl['k']
+
+        return cl['k'] * (cl['c'] * np.cos(angle + cl['alpha_0']) +
+                          1E6 * d * n * cl['delta'] * np.sin(cl['phi_0'] - angle + n * cl['delta'] / cl['f']) / cl['f'])
+
+    def mono_peak_steps(self):
+        # the grating model follows a sine: beyond this position wavelengths get shorter again
+        cl = self.calib
+        return (math.pi / 2 - cl['alpha_0']) / cl['k']
+
+    def mono_max_WL(self, n=0):
+        # longest wavelength the model puts on pixel n, found around the sine peak
+        s_peak = self.mono_peak_steps()
+        steps = s_peak * (1 + np.linspace(-0.05, 0.05, 2001))
+        return float(np.max(self.mono_toWL_array(steps, n)))
+
+    def plan_strip_positions(self, wl_start, wl_end=None, overlap_px=0, strips=None, iterations=4):
+        # Monochromator positions for a stitched spectrum: the first pixel of every strip falls on the
+        # pixel (CCD-w - overlap_px) of the previous one. Either the target end wavelength or the number
+        # of strips is given. Returns positions, per-strip axes and the achieved end wavelength.
+        # Strips stop at the sine peak of the model, an unreachable wl_end gives the longest reachable range.
+        width = self.conf['Andor']['CCD-w']
+        strip_size = width - overlap_px
+
+        s0 = float(self.mono_toSteps_array(wl_start))
+        ds = float(self.mono_toSteps_array(self.mono_toWL_array(s0, strip_size))) - s0
+        span = float(self.mono_toWL_array(s0, strip_size)) - wl_start
+
+        # upper bound of the strips up to the sine peak, the chain itself is cut where it stops matching
+        max_strips = max(1, int(2 * (self.mono_max_WL(0) - wl_start) / span) + 2)
+
+        if strips is None:
+            wl_end = min(wl_end, self.mono_max_WL(width))
+            strips = max(1, int(math.ceil((wl_end - float(self.mono_toWL_array(s0, width))) / span)) + 1)
+        strips = min(strips, max_strips)
+
+        while True:
+            steps = self.solve_strip_chain(s0, ds, strips, strip_size, iterations)
+            steps = self.valid_strips(steps, strip_size, span / strip_size)
+            if len(steps) < strips:
+                # the chain does not reach that far
+                strips = max_strips = len(steps)
+
+            if wl_end is None or strips == 1:
+                break
+
+            # trim the surplus strips or add missing ones to cover the requested range
+            ends = self.mono_toWL_array(steps, width)
+            covered = np.nonzero(ends >= wl_end)[0]
+            if covered.size:
+                strips = covered[0] + 1
+                steps = steps[:strips]
+                break
+
+            if strips >= max_strips:
+                # out of reach: up to the strip with the longest end wavelength
+                strips = int(np.argmax(ends)) + 1
+                steps = steps[:strips]
+                break
+            strips += 1
+
+        positions = [int(p) for p in np.round(steps)]
+        axes = self.mono_toWL_array(np.array(positions)[:, None], np.arange(width))
+        WL_end = float(self.mono_toWL_array(positions[-1], width))
+
+        return positions, axes, WL_end
+
+    def valid_strips(self, steps, strip_size, pixel_wl):
+        # Leading part of a strip chain that is solved: increasing positions below the sine peak, each
+        # strip starting within half a pixel of the previous one's end. The Newton steps of a strip only
+        # depend on the strips before it, so a diverging tail past the peak leaves that part intact.
+        mismatch = np.abs(self.mono_toWL_array(steps[1:], 0) - self.mono_toWL_array(steps[:-1], strip_size))
+        bad = (np.diff(steps) <= 0) | (steps[1:] > self.mono_peak_steps()) | ~(mismatch < pixel_wl / 2)
+        bad = np.nonzero(bad)[0]
+
+        return steps[:bad[0] + 1] if bad.size else steps
+
+    def solve_strip_chain(self, s0, ds, strips, strip_size, iterations=4):
+        # Newton solution of WL(s[i], 0) = WL(s[i-1], strip_size) for all strips at once.
+        # The Jacobian is lower bidiagonal, so each Newton step is a first order linear recurrence
+        # d[i] = a[i] * d[i-1] + b[i] which is solved with cumulative products and sums.
+        steps = s0 + ds * np.arange(strips, dtype=np.float64)
+        if strips == 1:
+            return steps
+
+        for i in range(iterations):
+            residual = self.mono_toWL_array(steps[1:], 0) - self.mono_toWL_array(steps[:-1], strip_size)
+            g0 = self.mono_dWL_dSteps(steps[1:], 0)
+            gp = self.mono_dWL_dSteps(steps[:-1], strip_size)
+
+            a = gp / g0
+            b = -residual / g0
+            a_prod = np.cumprod(a)
+            delta = a_prod * np.cumsum(b / a_prod)
+            steps[1:] += delta
+
+        return steps
+
     def mono_toWL0(self, steps):
         c = self.conf['MDR']['c']
         k = self.conf['MDR']['k']
@@ -107,22 +272,48 @@ class HardWare(object):
 
         return WL
 
-    def mono_pos(self):
-        if self.monoStatus:
-            msg = b"GP\n"
+    def mono_toWL_array(self, steps, pixel_indices):
+        # Vectorized mono_toWL: steps and pixel indices are broadcast against each other,
+        # e.g. steps[:, None] and np.arange(CCD-w) give one axis row per strip
+        cl = self.calib
+        steps = np.asarray(steps, dtype=np.float64)
+        n = np.asarray(pixel_indices, dtype=np.float64)
+        d = cl['d'][self.gratingIndex]
 
-            self.mono.write(msg)
-            while self.mono.out_waiting > 0:
-                time.sleep(0.1)
+        angle = steps * cl['k']
+        WL0 = np.sin(angle + cl['alpha_0']) * cl['c']
+        WL = WL0 + 1E6 * d * n * cl['delta'] * np.cos(cl['phi_0'] - angle + n * cl['delta'] / cl['f']) / cl['f']
 
-            time.sleep(1)
-            ans = self.mono.read(1)
-            while self.mono.in_waiting > 0:
-                ans += self.mono.read(1)
+        return WL
+
+    def strip_axis(self, steps, units='nm'):
+        # nm or eV axis of a single CCD strip taken at the given monochromator position
+        key = (self.gratingIndex, int(steps), self.calibHash)
+        axes = self.axisCache.get(key)
+        if axes is None:
+            wl = self.mono_toWL_array(steps, np.arange(self.conf['Andor']['CCD-w']))
+            ev = 1239.84193 / wl
+            wl.flags.writeable = False
+            ev.flags.writeable = False
+            axes = {'nm': wl, 'eV': ev}
+            self.axisCache.put(key, axes)
+
+        return axes[units]
+
+    def mono_command(self, cmd):
+        # non-blocking command, returns a Future with the reply line
+        if self.monoStatus:
+            return self.mono.command(cmd)
+        else:
+            future = Future()
+            future.set_result(False)
+            return future
 
-            ans_str = ans.decode("utf-8")
-            ans_str = ans_str[: -2]
-            if ans_str != 'ERROR' and not re.search(r'[^0-9]+?]', ans_str):
+    @instr.timed('hw.mono_pos')
+    def mono_pos(self):
+        if self.monoStatus:
+            ans_str = self.mono.request('GP')
+            if ans_str and re.fullmatch(r'[0-9]+', ans_str):
                 steps = int(ans_str)
                 return steps
             else:
@@ -130,80 +321,39 @@ class HardWare(object):
         else:
             return False
 
+    @instr.timed('hw.mono_status')
     def mono_status(self):
         if self.monoStatus:
-            msg = b"DS\n"
-
-            self.mono.write(msg)
-            while self.mono.out_waiting > 0:
-                time.sleep(0.1)
-
-            time.sleep(1)
-            ans = self.mono.read(1)
-            while self.mono.in_waiting > 0:
-                ans += self.mono.read(1)
-
-            ans_str = ans.decode("utf-8")
-            return ans_str[: -2]
+            return self.mono.request('DS')
         else:
             return False
 
+    @instr.timed('hw.mono_goto')
     def mono_goto(self, pos):
         if self.monoStatus:
-            msg = "GA" + str(round(abs(pos))) + "\n"
-
-            self.mono.write(msg.encode())
-            while self.mono.out_waiting > 0:
-                time.sleep(0.1)
-
-            time.sleep(1)
-            ans = self.mono.read(1)
-            while self.mono.in_waiting > 0:
-                ans += self.mono.read(1)
-
-            ans_str = ans.decode("utf-8")
-            return ans_str[: -2]
+            return self.mono.request("GA" + str(round(abs(pos))))
         else:
             return False
 
+    @instr.timed('hw.mono_move')
     def mono_move(self, dst):
         if self.monoStatus:
             if dst >= 0:
-                msg = "G+" + str(round(dst)) + "\n"
+                msg = "G+" + str(round(dst))
             else:
-                msg = "G-" + str(round(abs(dst))) + "\n"
-
-            self.mono.write(msg.encode())
-            while self.mono.out_waiting > 0:
-                time.sleep(0.1)
-
-            time.sleep(1)
-            ans = self.mono.read(1)
-            while self.mono.in_waiting > 0:
-                ans += self.mono.read(1)
+                msg = "G-" + str(round(abs(dst)))
 
-            ans_str = ans.decode("utf-8")
-            return ans_str[: -2]
+            return self.mono.request(msg)
         else:
             return False
 
     def mono_move_start(self):
         if self.monoStatus:
-            msg = b"G0\n"
-            self.mono.write(msg)
-            while self.mono.out_waiting > 0:
-                time.sleep(0.1)
-
-            time.sleep(1)
-            ans = self.mono.read(1)
-            while self.mono.in_waiting > 0:
-                ans += self.mono.read(1)
-
-            ans_str = ans.decode("utf-8")
-            return ans_str[: -2]
+            return self.mono.request('G0')
         else:
             return False
 
+    @instr.timed('hw.stage_position')
     def get_stage_position(self, axis='X', force=False):
         #s = self.mot[axis]
         cube = self.cubes[axis]
@@ -211,14 +361,57 @@ class HardWare(object):
             return cube.position
         else:
             while cube.is_moving:
-                time.sleep(1)
+                time.sleep(0.02)
             return cube.position
 
+    def stage_motion_params(self, axis='X'):
+        # max velocity (um/s) and acceleration (um/s^2) from the KCube settings, config values as fallback
+        try:
+            velocity, acceleration = self.cubes[axis].get_velocity_params()
+            return velocity * 1000, acceleration * 1000
+        except Exception:
+            return self.conf['Thorlabs']['stageVelocity'], self.conf['Thorlabs']['stageAcceleration']
+
+    def stage_set_velocity(self, axis, velocity, acceleration):
+        # velocity (um/s) and acceleration (um/s^2)
+        self.cubes[axis].set_velocity_params(velocity / 1000, acceleration / 1000)
+
+    def stage_counter(self, axis='X'):
+        return self.cubes[axis].get_position_counter()
+
+    def positions(self):
+        # absolute positions stored with the acquired data: stage counters (device units),
+        # monochromator steps (-1 if unknown) and the grating in use
+        pos = {'stage' + axis: self.stage_counter(axis) for axis in self.cubes}
+        mono = self.mono_pos()
+        pos['mono'] = mono if mono is not False else -1
+        pos['grating'] = self.gratingIndex
+
+        return pos
+
+    def stage_is_moving(self, axis='X'):
+        return self.cubes[axis].is_moving
+
     def stage_move(self, axis='X', dst=0):
         self.cubes[axis].move_steps(dst)
         #self.mot[axis]._port.send_message(
         #    MGMSG_MOT_MOVE_RELATIVE_long(chan_ident=self.mot[axis]._chan_ident, relative_distance=dst))
 
+    def move_many(self, moves):
+        # relative moves of several axes at once, e.g. {'X': dx, 'Y': dy};
+        # all moves are started before any is waited for, returns per-axis completion futures
+        futures = {axis: self.cubes[axis].move_steps_async(dst) for axis, dst in moves.items()}
+        if instr.enabled:
+            t = time.perf_counter()
+            for axis, future in futures.items():
+                future.add_done_callback(lambda f, a=axis: instr.record('stage.move.' + a, time.perf_counter() - t))
+
+        return futures
+
+    def goto_many(self, positions):
+        return {axis: self.cubes[axis].move_to_async(pos) for axis, pos in positions.items()}
+
+    @instr.timed('hw.stage_goto')
     def stage_goto(self, axis='X', pos=0):
         self.cubes[axis].move_to(pos)
         #self.mot[axis]._port.send_message(
@@ -235,3 +428,6 @@ class HardWare(object):
 
         if self.mono:
             self.mono.close()
+
+        if self.monoSim:
+            self.monoSim.stop()
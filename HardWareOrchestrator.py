@@ -0,0 +1,181 @@
+import asyncio
+from threading import Thread
+
+from PyQt5.QtCore import Qt, QObject, pyqtSignal
+
+
+class Orchestrator(object):
+    # asyncio event loop running in its own thread. Every device has its own lock, so independent
+    # axes and devices can be commanded concurrently while commands to one device stay ordered.
+    # Blocking driver calls are run in the loop's executor.
+
+    STAGE_AXES = ('X', 'Y', 'Z')
+
+    poll_interval = 0.02
+    # sec between the position reports of a grating move
+    progress_interval = 0.1
+
+    def __init__(self, hardware, ccd):
+        self.hardware = hardware
+        self.ccd = ccd
+
+        self.frameFuture = None
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        self.locks = self.submit(self.create_locks()).result()
+
+        self.ccd.frameAcquired.connect(self.frame_handler, Qt.DirectConnection)
+
+    async def create_locks(self):
+        return {dev: asyncio.Lock() for dev in self.STAGE_AXES + ('mono', 'ccd')}
+
+    def submit(self, coro):
+        # schedule a coroutine from any thread, returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, func, *args):
+        return self.loop.run_in_executor(None, func, *args)
+
+    async def move_stage(self, axis, steps):
+        positions = await self.move_stages({axis: steps})
+        return positions[axis]
+
+    async def move_stages(self, moves):
+        # moves: {'X': dx, 'Y': dy, ...}, all axes run at the same time
+        for axis in sorted(moves):
+            await self.locks[axis].acquire()
+        try:
+            futures = await self.call(self.hardware.move_many, moves)
+            positions = await asyncio.gather(*[asyncio.wrap_future(futures[axis]) for axis in moves])
+        finally:
+            for axis in moves:
+                self.locks[axis].release()
+
+        return dict(zip(moves.keys(), positions))
+
+    async def stage_idle(self, axis):
+        while await self.call(self.hardware.stage_is_moving, axis):
+            await asyncio.sleep(self.poll_interval)
+
+        return await self.call(self.hardware.get_stage_position, axis, True)
+
+    async def mono_idle(self, progress=None):
+        # progress(steps) is called with the grating position every progress_interval
+        reported = self.loop.time()
+        while True:
+            status = await asyncio.wrap_future(self.hardware.mono_command('DS'))
+            if status != 'BUSY':
+                return status == 'OK'
+
+            if progress is not None and self.loop.time() - reported >= self.progress_interval:
+                reported = self.loop.time()
+                progress(await self.call(self.hardware.mono_pos))
+            await asyncio.sleep(self.poll_interval)
+
+    async def mono_move(self, cmd, progress=None):
+        # grating move command and the wait for its end,
+        # returns the controller reply and the final position (False if the move was not started)
+        async with self.locks['mono']:
+            ans = await asyncio.wrap_future(self.hardware.mono_command(cmd))
+            if ans != 'OK':
+                return ans, False
+
+            await self.mono_idle(progress)
+            return ans, await self.call(self.hardware.mono_pos)
+
+    async def goto_wavelength(self, wl, progress=None):
+        # central pixel of the CCD is set to the given wavelength
+        steps = int(round(float(self.hardware.mono_toSteps_array(wl, self.hardware.conf['Andor']['CCD-w'] // 2))))
+        return await self.mono_move('GA' + str(abs(steps)), progress)
+
+    async def mono_home(self, progress=None):
+        # grating to the zero position, the reference for the step counter
+        return await self.mono_move('G0', progress)
+
+    async def mono_position(self):
+        async with self.locks['mono']:
+            return await self.call(self.hardware.mono_pos)
+
+    async def acquire_frame(self):
+        # single CCD frame, returned as a copy of the ring buffer slot
+        async with self.locks['ccd']:
+            self.frameFuture = self.loop.create_future()
+            self.ccd.frame()
+            try:
+                return await asyncio.wait_for(self.frameFuture, self.ccd.frame_timeout() + 1.0)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self.frameFuture = None
+
+    def frame_handler(self, slot):
+        # FrameProvider thread; frames not requested by acquire_frame are left to other consumers
+        future = self.frameFuture
+        if future is not None:
+            self.ccd.claim_frame(slot)
+            data = self.ccd.frame_data(slot).copy()
+            self.ccd.release_frame(slot)
+            self.loop.call_soon_threadsafe(self.set_frame, future, data)
+
+    def set_frame(self, future, data):
+        if not future.done():
+            future.set_result(data)
+
+    async def wait_idle(self, devices=None):
+        # wait until the given devices (all by default) have stopped
+        if devices is None:
+            devices = self.STAGE_AXES + ('mono',)
+
+        waits = []
+        for dev in devices:
+            if dev == 'mono':
+                waits.append(self.mono_idle())
+            else:
+                waits.append(self.stage_idle(dev))
+
+        return await asyncio.gather(*waits)
+
+    async def read_temperature(self):
+        return await self.call(self.ccd.get_temperature)
+
+    def shut_down(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(1.0)
+
+
+class OrchestratorBridge(QObject):
+    # Delivers orchestrator results to callbacks running in the GUI thread
+
+    resultReady = pyqtSignal(object, object)
+    errorOccurred = pyqtSignal(str)
+
+    def __init__(self, orchestrator):
+        super().__init__()
+
+        self.orchestrator = orchestrator
+        self.resultReady.connect(self.deliver, Qt.QueuedConnection)
+
+    def notifier(self, callback):
+        # thread-safe function passing its argument to callback in the GUI thread, e.g. for progress
+        return lambda result: self.resultReady.emit(callback, result)
+
+    def run(self, coro, callback=None):
+        future = self.orchestrator.submit(coro)
+        future.add_done_callback(lambda f: self.done(f, callback))
+        return future
+
+    def done(self, future, callback):
+        if future.cancelled():
+            return
+
+        err = future.exception()
+        if err is not None:
+            self.errorOccurred.emit(repr(err))
+        elif callback is not None:
+            self.resultReady.emit(callback, future.result())
+
+    def deliver(self, callback, result):
+        callback(result)
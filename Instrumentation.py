@@ -0,0 +1,150 @@
+import json
+import time
+import bisect
+from threading import Lock
+from functools import wraps
+
+
+# Hot-path timers. Code is wrapped in named spans:
+#
+#   with instr.span('ccd.read'):
+#       ...
+#
+# whole calls are timed with the @instr.timed('hw.mono_goto') decorator, or durations measured elsewhere
+# are passed to record(). Every name keeps a count, sum, min, max and a log-spaced histogram, so memory
+# does not grow with the run time. While disabled span() returns a shared
+# no-op context manager and record() returns at once, the cost is a global lookup and a call.
+
+enabled = False
+
+# histogram bucket upper edges (sec): 10 us .. ~170 s, doubling
+EDGES = [1E-5 * 2 ** i for i in range(25)]
+
+_lock = Lock()
+_stats = {}
+
+
+class Stat(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets = [0] * (len(EDGES) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(EDGES, value)] += 1
+
+    def percentile(self, q):
+        # upper edge of the bucket holding the q-th percentile, clipped to the observed range
+        rank = q / 100 * self.count
+        n = 0
+        for i, c in enumerate(self.buckets):
+            n += c
+            if n >= rank and c:
+                edge = EDGES[i] if i < len(EDGES) else self.max
+                return min(max(edge, self.min), self.max)
+
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max
+        }
+
+
+class Span(object):
+    __slots__ = ('name', 't')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.t)
+        return False
+
+
+class NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_span = NullSpan()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def span(name):
+    return Span(name) if enabled else _null_span
+
+
+def timed(name):
+    # decorator, the whole call is one span
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+
+            t = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - t)
+
+        return wrapper
+
+    return decorator
+
+
+def record(name, seconds):
+    if not enabled:
+        return
+
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = Stat()
+        stat.add(seconds)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def snapshot():
+    with _lock:
+        return {name: stat.summary() for name, stat in sorted(_stats.items())}
+
+
+def dump(path):
+    data = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'spans': snapshot()}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+    return data
@@ -1,15 +1,17 @@
 from PyQt5.QtWidgets import (QMainWindow, QDesktopWidget, QWidget, QTabWidget, QMenu, QMessageBox)
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QFileSystemWatcher, QTimer
 import qdarkstyle
 import json
 
 from SpectraModule import SpectraModule
 from ScanModule import ScanModule
 from CameraWI import CamWI
-from WidgetsUI import VTabBar
+from WidgetsUI import VTabBar, StatsPanel
 from HardWareController import HardWare
+from HardWareOrchestrator import Orchestrator
 from AndorController import AndorCCD
 from CameraController import Cam
+import Instrumentation as instr
 
 
 class AppWindow(QMainWindow):
@@ -36,6 +38,8 @@ class AppWindow(QMainWindow):
 
         self.resize(self.paramSet['windowSize']['width'], self.paramSet['windowSize']['height'])
 
+        instr.enable(self.paramSet['instrumentation']['enabled'])
+
         qr = self.frameGeometry()
         cp = QDesktopWidget().availableGeometry().center()
         qr.moveCenter(cp)
@@ -43,10 +47,20 @@ class AppWindow(QMainWindow):
 
         self.hardware = HardWare(self.hardwareConf)
         self.ccd = AndorCCD(self.hardwareConf['Andor'], self.paramSet['Andor'])
+        self.orchestrator = Orchestrator(self.hardware, self.ccd)
 
         self.ui_construct()
         self.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5())
 
+        # reload monochromator calibration when hardware-config.json is edited
+        self.configWatcher = QFileSystemWatcher(['hardware-config.json'], self)
+        self.configWatcher.fileChanged.connect(self.hardware_config_changed)
+
+        # periodic dump of the timing statistics
+        self.statsTimer = QTimer(self)
+        self.statsTimer.timeout.connect(self.stats_dump)
+        self.statsTimer.start(int(self.paramSet['instrumentation']['dumpInterval'] * 1000))
+
     def ui_construct(self):
         # Main widget
         self.mainWidget = QTabWidget(self)
@@ -61,13 +75,24 @@ class AppWindow(QMainWindow):
         self.setWindowTitle('CernaFluoScan')
         self.statusBar().showMessage("Cerna Fluorescence Scan Microscope control")
 
+        self.viewMenu = QMenu('&View', self)
+
         self.menuBar().addMenu(self.fileMenu)
+        self.menuBar().addMenu(self.viewMenu)
         self.menuBar().addSeparator()
         self.menuBar().addMenu(self.helpMenu)
 
         self.fileMenu.addAction('&Quit', self.file_quit, Qt.CTRL + Qt.Key_Q)
         self.helpMenu.addAction('&About', self.about)
 
+        # Timing statistics
+        self.statsPanel = StatsPanel(self)
+        self.statsPanel.enabledChk.toggled.connect(self.stats_enable)
+        self.statsPanel.dumpBtn.clicked.connect(self.stats_dump)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.statsPanel)
+        self.statsPanel.hide()
+        self.viewMenu.addAction(self.statsPanel.toggleViewAction())
+
         # Camera control module
         self.CamCtrl = Cam()
         # Camera widget
@@ -81,8 +106,8 @@ class AppWindow(QMainWindow):
         # self.scanModuleUI = ScanModuleUI(self.CameraScWI, self.statusBar())
         # Module for analysis data
 
-        self.spectraModule = SpectraModule(self.CameraSpWI, self.ccd, self.hardware, self.hardwareConf['Andor'],
-                                           self.paramSet, self.statusBar())
+        self.spectraModule = SpectraModule(self.CameraSpWI, self.ccd, self.hardware, self.orchestrator,
+                                           self.hardwareConf['Andor'], self.paramSet, self.statusBar())
         self.spectraModule.setFocus()
 
         self.scanModule = ScanModule(self.CameraScWI, self.spectraModule, self.hardware, self.paramSet, self.statusBar())
@@ -110,6 +135,41 @@ class AppWindow(QMainWindow):
             self.CameraSpWI.active = False
             self.CameraScWI.active = False
 
+    def stats_enable(self, is_checked):
+        self.paramSet['instrumentation']['enabled'] = is_checked
+
+    def stats_dump(self):
+        if not instr.enabled:
+            return
+
+        path = self.paramSet['instrumentation']['dumpPath']
+        try:
+            spans = instr.dump(path)['spans']
+        except OSError as e:
+            print('Timing statistics dump error:', e)
+            return
+
+        for name, stat in spans.items():
+            print('{0}: {1} calls, mean {2:.2f} ms, p90 {3:.2f} ms'.format(
+                name, stat['count'], stat['mean'] * 1000, stat['p90'] * 1000))
+
+    def hardware_config_changed(self, path):
+        # some editors replace the file, so it has to be watched again
+        if path not in self.configWatcher.files():
+            self.configWatcher.addPath(path)
+
+        try:
+            with open(path, 'r') as f:
+                conf = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.hardwareConf['MDR'] = conf['MDR']
+        if self.hardware.load_calibration():
+            self.spectraModule.update_wl_limits()
+            self.spectraModule.x_units_change()
+            self.statusBar().showMessage('Monochromator calibration reloaded')
+
     def shut_down(self):
         print('Save parameters...')
         with open('current-params.json', 'w') as f:
@@ -121,6 +181,7 @@ class AppWindow(QMainWindow):
         self.CameraScWI.shut_down()
 
         print('Shutting down HardWare...')
+        self.orchestrator.shut_down()
         self.hardware.shut_down()
 
         print('Shutting down the Andor CCD...')
@@ -0,0 +1,121 @@
+import re
+import time
+from threading import Thread, Event
+from queue import Queue, Empty
+from concurrent.futures import Future
+
+import serial
+import serial.tools.list_ports
+
+import Instrumentation as instr
+
+
+class MonoTimeoutError(Exception):
+    pass
+
+
+class MonoDriver(object):
+    # MDR-3 monochromator serial driver.
+    # A reader thread splits the incoming stream into '\r\n' terminated lines; a command thread
+    # sends queued requests one at a time and completes their futures as soon as the reply arrives.
+
+    TERMINATOR = b'\r\n'
+
+    # default reply timeouts (sec) by command prefix
+    TIMEOUTS = {'DS': 1.0, 'DM': 2.0, 'GP': 1.0, 'GA': 2.0, 'G+': 2.0, 'G-': 2.0, 'G0': 2.0}
+
+    def __init__(self, port, baudrate=9600):
+        self.dev = serial.Serial(port, baudrate, timeout=0.05)
+
+        self.lines = Queue()
+        self.requests = Queue()
+        self.stop_event = Event()
+
+        self.reader = Thread(target=self.read_loop, daemon=True)
+        self.writer = Thread(target=self.command_loop, daemon=True)
+        self.reader.start()
+        self.writer.start()
+
+    def read_loop(self):
+        buf = b''
+        while not self.stop_event.is_set():
+            try:
+                chunk = self.dev.read(max(1, self.dev.in_waiting))
+            except (serial.SerialException, OSError, TypeError):
+                break
+
+            if chunk:
+                buf += chunk
+                while self.TERMINATOR in buf:
+                    line, buf = buf.split(self.TERMINATOR, 1)
+                    self.lines.put(line.decode('utf-8', errors='replace'))
+
+    def command_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                cmd, timeout, future = self.requests.get(timeout=0.5)
+            except Empty:
+                continue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            # drop replies which arrived after their command had timed out
+            while not self.lines.empty():
+                self.lines.get_nowait()
+
+            try:
+                t = time.perf_counter()
+                self.dev.write((cmd + '\n').encode())
+                self.dev.flush()
+                reply = self.lines.get(timeout=timeout)
+                instr.record('mono.' + cmd[:2], time.perf_counter() - t)
+                future.set_result(reply)
+            except Empty:
+                future.set_exception(MonoTimeoutError('No reply to ' + cmd))
+            except (serial.SerialException, OSError) as e:
+                future.set_exception(e)
+
+    def command(self, cmd, timeout=None):
+        # returns a Future with the reply line
+        if timeout is None:
+            timeout = self.TIMEOUTS.get(cmd[:2], 2.0)
+
+        future = Future()
+        self.requests.put((cmd, timeout, future))
+        return future
+
+    def request(self, cmd, timeout=None):
+        # blocking command, False on timeout or connection error
+        try:
+            return self.command(cmd, timeout).result()
+        except (MonoTimeoutError, serial.SerialException, OSError):
+            return False
+
+    def identify(self):
+        ans = self.request('DM')
+        return ans is not False and re.search(r'Monochromator controller', ans) is not None
+
+    def close(self):
+        self.stop_event.set()
+        self.writer.join(1.0)
+        self.reader.join(1.0)
+        self.dev.close()
+
+
+def discover_mono():
+    ports = serial.tools.list_ports.comports()
+    for p in ports:
+        if re.search(r'USB-to-Serial', p.description):
+            try:
+                dev = MonoDriver(p.device)
+                # the controller resets when the port is opened
+                time.sleep(1)
+                if dev.identify():
+                    return dev
+                else:
+                    dev.close()
+            except serial.serialutil.SerialException:
+                pass
+
+    return None
@@ -1,8 +1,20 @@
 from functools import partial
 import threading
 import time
+from math import ceil
+from threading import Event
+from queue import Queue, Empty
+
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtWidgets import QFileDialog
+import numpy as np
+import os
 
 from ScanModuleUI import ScanModuleUI
+from ScanPlan import ScanPlan
+from DataWriter import DataWriter
+from SpectrumCube import SpectrumCube
+import Instrumentation as instr
 
 
 class ScanModule(ScanModuleUI):
@@ -17,6 +29,15 @@ class ScanModule(ScanModuleUI):
         self.spectraModule = spectra_module
         self.statusBar = status_bar
 
+        self.scanPlan = None
+        self.scanMap = np.zeros((1, 1))
+        self.scanCube = None
+        # map pixels (row, col) scanned by the nearest neighbour order
+        self.pickedPoints = set()
+
+        self.dataWriter = DataWriter()
+        self.scanExecutor = ScanExecutor(self)
+
         self.connect_events()
         self.init_parameters(self.paramSet)
 
@@ -33,10 +54,24 @@ class ScanModule(ScanModuleUI):
             el['action'].currentIndexChanged.connect(partial(self.scan_actions_change, idx=i, par_id=1))
             el['par1'].textChanged.connect(partial(self.scan_actions_change, idx=i, par_id=2))
 
+        self.scanOrder.currentIndexChanged.connect(self.scan_order_change)
+        self.scanFly.toggled.connect(self.scan_fly_change)
+        self.scanChooseDst.clicked.connect(self.change_dst_path)
         self.scanStart.clicked.connect(self.run_scan)
+        self.scanPause.clicked.connect(self.scanExecutor.pause)
+        self.scanResume.clicked.connect(self.scanExecutor.resume)
+        self.scanAbort.clicked.connect(self.scanExecutor.abort)
+
+        self.scanExecutor.pointDone.connect(self.scan_point_done)
+        self.scanExecutor.logMessage.connect(self.scanLog.append)
+        self.scanExecutor.finished.connect(self.scan_finished)
+
+        self.mapFrame.scene().sigMouseClicked.connect(self.map_click)
 
     def stop_threads(self):
         self._scanThread = False
+        self.scanExecutor.abort()
+        self.scanExecutor.wait()
 
     def scan_setup_change(self, val, idx=0, par_id=0):
         si = str(idx)
@@ -49,6 +84,8 @@ class ScanModule(ScanModuleUI):
         elif par_id == 3:
             self.paramSet['scanSet'][si]['step'] = int(val)
 
+        self.update_estimate()
+
     def scan_actions_change(self, val, idx=0, par_id=0):
         si = str(idx)
         if par_id == 0:
@@ -58,41 +95,418 @@ class ScanModule(ScanModuleUI):
         elif par_id == 2:
             self.paramSet['scanActions'][si]['par1'] = val
 
-    def perform_actions(self, scan_actions):
-        legend = ["X", "Y", "Z", "WL"]
+    def scan_order_change(self, idx):
+        self.paramSet['scanOrder'] = idx
+        self.update_estimate()
 
-        for action in scan_actions:
-            if action['id'] == 1:
-                print('Take frame')
-    #           self.spectraModule.acquire()
-
-    def dim_scan(self, scan_set, scan_actions, seq_num=0):
-        legend = ["X", "Y", "Z", "WL"]
-
-        start = 0
-        stop = scan_set[seq_num]['count'] * scan_set[seq_num]['step']
-        step = scan_set[seq_num]['step']
-        for i in range(start, stop, step):
-            print(legend[scan_set[seq_num]['id'] - 1] + ': ' + str(i))
-            if seq_num < len(scan_set) - 1:
-                self.dim_scan(scan_set, scan_actions, seq_num + 1)
+    def change_dst_path(self):
+        path = QFileDialog.getExistingDirectory(self, 'Choose scan data directory', self.scanDstPath.text())
+        if path:
+            self.scanDstPath.setText(path)
 
-            self.perform_actions(scan_actions)
+    def scan_fly_change(self, is_checked):
+        self.paramSet['scanFly'] = is_checked
 
-    def run_scan(self):
-        # print(self.paramSet['scanSet'])
+    def scan_set(self):
         scan_set = []
         for i in range(len(self.paramSet['scanSet'])):
             if self.paramSet['scanSet'][str(i)]['use']:
-                scan_set.insert(i, self.paramSet['scanSet'][str(i)])
+                scan_set.append(self.paramSet['scanSet'][str(i)])
+
+        return scan_set
 
+    def make_plan(self):
         scan_actions = []
         for i in range(len(self.paramSet['scanActions'])):
             if self.paramSet['scanActions'][str(i)]['use']:
-                scan_actions.insert(i, self.paramSet['scanActions'][str(i)])
+                scan_actions.append(self.paramSet['scanActions'][str(i)])
+
+        # the nearest neighbour order is a tour through the picked map points only
+        order = ScanPlan.ORDERS[self.paramSet['scanOrder']]
+        plan = ScanPlan(self.scan_set())
+        if order == 'nearest':
+            plan = ScanPlan(self.scan_set(), plan.map_subset(self.pickedPoints))
+        plan.set_order(order)
+
+        return plan, scan_actions
+
+    def update_estimate(self):
+        plan, scan_actions = self.make_plan()
+        velocity, acceleration = self.hardware.stage_motion_params()
+        est = plan.estimate(self.hardware.minStageStep, velocity, acceleration)
+
+        self.scanEstimate.setText('{0} points, travel {1:.0f} um, motion {2:.0f} s'.format(
+            len(plan), sum(est['travel'].values()), est['time']))
+
+        # the map shows the scan area, so points can be picked before the scan
+        if not self.scanExecutor.isRunning() and self.scanMap.shape != plan.map_shape():
+            self.scanMap = np.zeros(plan.map_shape())
+            self.mapFrame.image.setImage(self.scanMap)
+        self.show_picks(plan)
+
+    def show_picks(self, plan):
+        # picked points outside the current scan area are kept but not shown
+        picks = [p for p in self.pickedPoints if plan.map_point(*p) is not None]
+        self.mapPicks.setData([c + 0.5 for r, c in picks], [r + 0.5 for r, c in picks])
+
+    def run_scan(self):
+        if self.scanExecutor.isRunning():
+            return
+
+        self.scanPlan, scan_actions = self.make_plan()
+        if len(self.scanPlan) == 0:
+            self.scanLog.append('No map points picked, Ctrl+click the scan map to pick them')
+            return
+
+        self.scanMap = np.zeros(self.scanPlan.map_shape())
+        self.scanProgress.setValue(0)
+        self.scanStart.setEnabled(False)
+        self.scanLog.append('Scan started: ' + ' x '.join(
+            a + '(' + str(c) + ')' for a, c in zip(self.scanPlan.axes, self.scanPlan.counts)))
+
+        # scan data is streamed to <directory>/<filename>.h5
+        filename = self.scanDstFilename.text() or time.strftime('scan-%Y%m%d-%H%M%S')
+        path = os.path.join(self.scanDstPath.text(), filename + '.h5')
+        params = dict(self.paramSet, comment=self.scanExpmntComment.toPlainText())
+        if self.dataWriter.open(path, params, self.scanPlan.counts):
+            self.scanLog.append('Saving to ' + path)
+
+        self.scanCube = self.make_cube(self.scanPlan)
+
+        self.scanExecutor.setup(self.scanPlan, scan_actions, self.paramSet['scanFly'])
+        self.scanExecutor.start()
+
+    def make_cube(self, plan):
+        # CCD data of every scan point: single frames for a fly scan, stitched spectra otherwise
+        sp_module = self.spectraModule
+        if self.paramSet['scanFly'] and plan.can_fly():
+            width = sp_module.ccdWidth
+            mono_pos = self.hardware.mono_pos()
+            axis = self.hardware.strip_axis(mono_pos) if mono_pos is not False else None
+        else:
+            if sp_module.scanFrameShown:
+                sp_module.x_units_change()
+            width = sp_module.spWidth
+            axis = sp_module.coordinates.copy()
+
+        cube = SpectrumCube(sp_module.ccdHeight, width, plan.counts, axis=axis, directory=self.paramSet['dataPath'])
+        self.scanLog.append('Scan data: {0:.1f} MB'.format(cube.nbytes / 2 ** 20))
+
+        return cube
+
+    def map_click(self, e):
+        # Ctrl+click picks a map point for the nearest neighbour order,
+        # click shows the CCD data of the clicked map point in the spectrum widgets
+        pos = self.mapFrame.image.mapFromScene(e.scenePos())
+        if e.modifiers() & Qt.ControlModifier:
+            pixel = (int(np.floor(pos.y())), int(np.floor(pos.x())))
+            plan = ScanPlan(self.scan_set())
+            if plan.map_point(*pixel) is not None:
+                self.pickedPoints ^= {pixel}
+                self.update_estimate()
+            return
+
+        if self.scanPlan is None or self.scanCube is None:
+            return
+
+        index = self.scanPlan.map_point(int(pos.y()), int(pos.x()))
+        if index is not None:
+            self.spectraModule.show_frame(self.scanCube.frame(index), self.scanCube.axis)
+
+    def scan_point_done(self, idx, value):
+        self.scanMap[self.scanPlan.map_index(idx)] = value
+        with instr.span('render.map'):
+            self.mapFrame.image.setImage(self.scanMap)
+        self.scanProgress.setValue(int(100 * (idx + 1) / len(self.scanPlan)))
+
+    def scan_finished(self):
+        self.scanStart.setEnabled(True)
+        self.statusBar.showMessage('Scan finished')
+
+
+class ScanExecutor(QThread):
+    # Runs a precomputed ScanPlan: stage/monochromator moves and the scan actions for every point.
+
+    pointDone = pyqtSignal(int, float)
+    logMessage = pyqtSignal(str)
+
+    def __init__(self, scan_module):
+        super().__init__()
+
+        self.scanModule = scan_module
+        self.hardware = scan_module.hardware
+        self.spectraModule = scan_module.spectraModule
+        self.dataWriter = scan_module.dataWriter
+
+        self.plan = None
+        self.actions = []
+
+        # continuous-motion scan along the fastest dimension
+        self.fly = False
+        self.flyFrames = None
+        # frames of the current line, copied out of the CCD ring as they arrive
+        self.flyData = None
+        self.flyStamps = None
+        self.flyCount = 0
+        self.lineLogs = []
+
+        self.running = Event()
+        self.abort_event = Event()
+
+        self.spectraModule.ccd.frameAcquired.connect(self.fly_frame, Qt.DirectConnection)
+
+    def setup(self, plan, actions, fly=False):
+        self.plan = plan
+        self.actions = actions
+        self.fly = fly
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def abort(self):
+        self.abort_event.set()
+        self.running.set()
+
+    def wait_running(self):
+        while not self.running.wait(0.1):
+            pass
+
+        return not self.abort_event.is_set()
+
+    def move(self, prev_point, point, wl_origin):
+        stage, wl = self.plan.moves(prev_point, point)
+
+        futures = self.hardware.move_many(stage)
+        if wl is not None and wl_origin is not False:
+            self.hardware.mono_goto(wl_origin + wl)
+            while self.hardware.mono_status() == 'BUSY':
+                time.sleep(0.05)
+
+        for f in futures.values():
+            f.result()
+
+    def perform_actions(self, idx):
+        value = 0.0
+        for action in self.actions:
+            if action['id'] == 1:
+                # acquire spectra
+                if self.spectraModule.acquire_wait():
+                    cube = self.scanModule.scanCube
+                    cube.put(self.plan.grid[idx], self.spectraModule.spCube.frame())
+                    sp_data = cube.frame(self.plan.grid[idx])
+                    value = float(sp_data.sum())
+                    self.dataWriter.write_point(self.plan.grid[idx], self.plan.points[idx], sp_data, cube.axis)
+
+        return value
+
+    def run(self):
+        self.abort_event.clear()
+        self.running.set()
+
+        # scan offsets are relative, the origin places the file back on the stage
+        self.dataWriter.write_positions('scan', self.hardware.positions())
+
+        t_start = time.perf_counter()
+        if self.fly and self.plan.can_fly():
+            self.run_fly()
+        else:
+            self.run_steps()
+
+        self.dataWriter.close()
+
+        self.logMessage.emit('Scan time: {0:.1f} s'.format(time.perf_counter() - t_start))
+
+    def run_steps(self):
+        plan = self.plan
+        wl_origin = self.hardware.mono_pos() if 'WL' in plan.axes else False
+
+        prev_point = np.zeros(plan.points.shape[1], dtype=np.int64)
+        for idx, point in enumerate(plan.points):
+            if not self.wait_running():
+                self.logMessage.emit('Scan aborted at point ' + str(idx))
+                break
+
+            with instr.span('scan.move'):
+                self.move(prev_point, point, wl_origin)
+            prev_point = point
+
+            with instr.span('scan.actions'):
+                value = self.perform_actions(idx)
+            self.pointDone.emit(idx, value)
+
+        # back to the scan origin
+        self.move(prev_point, np.zeros_like(prev_point), wl_origin)
+
+    def fly_frame(self, slot):
+        # FrameProvider thread, frames are only taken while a fly line is running. The frame is copied
+        # into the line buffer and its ring slot is released on return, so a line longer than the ring
+        # does not stall the series.
+        frames = self.flyFrames
+        if frames is not None and self.flyCount < len(self.flyData):
+            ccd = self.spectraModule.ccd
+            k = self.flyCount
+            self.flyData[k] = ccd.frame_data(slot)
+            self.flyStamps[k] = ccd.frame_time(slot)
+            self.flyCount = k + 1
+            frames.put(k)
+
+    def fly_setup(self, axis, step):
+        # Velocity/exposure matching: the stage passes one map pixel per kinetic cycle.
+        # The cycle is stretched if the required velocity is above the stage maximum.
+        ccd = self.spectraModule.ccd
+        step_um = step * self.hardware.minStageStep
+        v_max, acceleration = self.hardware.stage_motion_params(axis)
+
+        # readout-limited series: the minimum kinetic cycle, not the one set for spectra
+        acq = dict(self.spectraModule.paramSet['Andor']['AcqMode'])
+        acq.update({'mode': 2, 'kSeries': self.plan.counts[-1], 'kCycle': 0, 'accumFrames': 1})
+        ccd.set_acq_mode(acq)
+        timings = ccd.frame_timings()
+        if not timings:
+            return False
+
+        if step_um / timings.kinetic > v_max:
+            acq['kCycle'] = step_um / v_max
+            ccd.set_acq_mode(acq)
+            timings = ccd.frame_timings()
+
+        velocity = step_um / timings.kinetic
+        # run-up distance (steps) to reach constant velocity before the first map pixel
+        run_up = int(ceil(velocity * velocity / (2 * acceleration) / self.hardware.minStageStep)) + step
+
+        self.logMessage.emit('Fly scan: {0:.1f} um/s, frame cycle {1:.3f} s, exposure {2:.3f} s'.format(
+            velocity, timings.kinetic, timings.exposure))
+
+        return velocity, acceleration, v_max, run_up
+
+    def fly_line(self, axis, distance, origin, pitch, n):
+        # Moves the stage through the line at constant velocity, starts the kinetic series when the
+        # stage reaches the first pixel and logs (time, position) until the move is over.
+        # Returns the position log and the line buffer index of every frame.
+        ccd = self.spectraModule.ccd
+        self.flyCount = 0
+        self.flyFrames = Queue()
+
+        t_log = []
+        p_log = []
+        trigger = origin - pitch / 2
+        triggered = False
+
+        move = self.hardware.move_many({axis: distance})[axis]
+        while not move.done():
+            t_log.append(time.perf_counter())
+            p_log.append(self.hardware.stage_counter(axis))
+            if not triggered and (p_log[-1] - trigger) * np.sign(pitch) >= 0:
+                ccd.frame()
+                triggered = True
+            time.sleep(0.005)
+
+        frames = []
+        while triggered and len(frames) < n:
+            try:
+                frames.append(self.flyFrames.get(timeout=ccd.frame_timeout()))
+            except Empty:
+                break
+
+        # frames of an incomplete series must not reach the next line
+        self.flyFrames = None
+        if triggered:
+            ccd.stop_acquisition()
+            ccd.wait_idle(ccd.frame_timeout())
+
+        return np.array(t_log), np.array(p_log), frames
+
+    def fly_pixels(self, offsets, n):
+        # Line pixel of every frame from its position (pixels from the first one), frames in the order
+        # taken. Every frame gets its own pixel: the nearest one after the previous frame's that leaves
+        # room for the frames still to come. A complete line is assigned in frame order.
+        if len(offsets) == n:
+            return np.arange(n)
+
+        pixels = np.empty(len(offsets), dtype=int)
+        prev = -1
+        for i, offset in enumerate(np.round(offsets)):
+            prev = int(min(max(offset, prev + 1), n - len(offsets) + i))
+            pixels[i] = prev
+
+        return pixels
+
+    def run_fly(self):
+        plan = self.plan
+        ccd = self.spectraModule.ccd
+        axis = plan.axes[-1]
+        step = int(plan.steps[-1])
+        n = plan.counts[-1]
+
+        params = self.fly_setup(axis, step)
+        if not params:
+            self.logMessage.emit('Fly scan: CCD is not connected')
+            return
+        velocity, acceleration, v_max, run_up = params
+
+        self.lineLogs = []
+        self.flyData = np.empty((n, ccd.conf['CCD-h'], ccd.conf['CCD-w']), dtype=np.uint16)
+        self.flyStamps = np.zeros(n)
+        wl_origin = self.hardware.mono_pos() if 'WL' in plan.axes else False
+
+        # frames are taken at the current monochromator position
+        cube = self.scanModule.scanCube
+        prev_point = np.zeros(plan.points.shape[1], dtype=np.int64)
+        for line_idx, rows in enumerate(plan.lines()):
+            if not self.wait_running():
+                self.logMessage.emit('Scan aborted at line ' + str(line_idx))
+                break
+
+            first = plan.points[rows[0]]
+            last = plan.points[rows[-1]]
+            direction = 1 if last[-1] >= first[-1] else -1
+
+            start = first.copy()
+            start[-1] -= direction * run_up
+            self.move(prev_point, start, wl_origin)
+
+            origin = self.hardware.stage_counter(axis) + direction * run_up
+            distance = direction * (abs(int(last[-1] - first[-1])) + 2 * run_up)
+
+            self.hardware.stage_set_velocity(axis, velocity, acceleration)
+            t_log, p_log, frames = self.fly_line(axis, distance, origin, direction * step, n)
+            self.hardware.stage_set_velocity(axis, v_max, acceleration)
+
+            # frame positions interpolated from the position log at the middle of every exposure
+            stamps = self.flyStamps[frames]
+            positions = np.interp(stamps, t_log, p_log) if len(t_log) else np.full(len(frames), origin)
+            pixels = self.fly_pixels((positions - origin) / (direction * step), n)
+            frame_by_pixel = dict(zip(pixels, frames))
+
+            # points in trajectory order, a pixel without a frame is cleared instead of keeping old data
+            missed = []
+            for row in rows:
+                pixel = abs(int(plan.grid[row, -1] - plan.grid[rows[0], -1]))
+                if pixel in frame_by_pixel:
+                    cube.put(plan.grid[row], self.flyData[frame_by_pixel[pixel]])
+                    frame = cube.frame(plan.grid[row])
+                    value = float(frame.sum())
+                    self.dataWriter.write_point(plan.grid[row], plan.points[row], frame, cube.axis)
+                else:
+                    missed.append(pixel)
+                    cube.put(plan.grid[row], np.zeros_like(self.flyData[0]))
+                    value = 0.0
+                self.pointDone.emit(int(row), value)
+
+            if missed:
+                self.logMessage.emit('Line {0}: no frame for pixels {1}'.format(line_idx, missed))
+
+            self.lineLogs.append({'line': line_idx, 'time': t_log, 'position': p_log,
+                                  'frameTime': stamps, 'framePosition': positions})
+            self.logMessage.emit('Line {0}: {1} frames, pitch error {2:.1f} steps'.format(
+                line_idx, len(frames), float(np.abs(np.diff(positions) - direction * step).max())
+                if len(frames) > 1 else 0.0))
 
-        # print(scan_set)
-        # for v in reversed(scan_set):
-        #     print(v)
+            prev_point = last.copy()
+            prev_point[-1] += direction * run_up
 
-        self.dim_scan(scan_set, scan_actions)
\ No newline at end of file
+        ccd.set_acq_mode(self.spectraModule.paramSet['Andor']['AcqMode'])
+        self.move(prev_point, np.zeros_like(prev_point), wl_origin)
@@ -37,6 +37,9 @@ class ScanModuleUI(QWidget):
             el['action'].setCurrentIndex(scan_actions[si]['id'])
             el['par1'].setText(scan_actions[si]['par1'])
 
+        self.scanOrder.setCurrentIndex(param_set['scanOrder'])
+        self.scanFly.setChecked(param_set['scanFly'])
+
     def ui_construct(self):
         # Main splitters
         topleft_frame = QFrame(self)
@@ -78,6 +81,9 @@ class ScanModuleUI(QWidget):
         # Scan map layout
 
         self.mapFrame = PgGraphicsView(smap)
+        # map points picked for a sparse scan, Ctrl+click toggles a point
+        self.mapPicks = pg.ScatterPlotItem(size=8, pen=pg.mkPen('r'), brush=None, symbol='s')
+        self.mapFrame.vb.addItem(self.mapPicks)
 
         map_lay = QGridLayout(smap)
         map_lay.addWidget(self.mapFrame)
@@ -252,6 +258,22 @@ class ScanModuleUI(QWidget):
         scan_buttons_lay.addWidget(self.scanResume)
         scan_buttons_lay.addWidget(self.scanAbort)
 
+        self.scanOrder = QComboBox(self)
+        self.scanOrder.addItems(['Raster', 'Serpentine', 'Hilbert curve', 'Nearest neighbour (picked points)'])
+        self.scanOrder.setToolTip('Nearest neighbour scans only the map points picked by Ctrl+click on the scan map')
+        self.scanFly = QCheckBox('Fly scan')
+        self.scanFly.setToolTip('Continuous stage motion along the last scan dimension, one CCD frame per point')
+        scan_order_lbl = QLabel('Trajectory: ')
+        self.scanEstimate = QLabel('')
+        self.scanEstimate.setStyleSheet("color: grey")
+        scan_order_group = QFrame(self)
+        scan_order_lay = QHBoxLayout(scan_order_group)
+        scan_order_lay.setContentsMargins(0, 0, 0, 0)
+        scan_order_lay.addWidget(scan_order_lbl)
+        scan_order_lay.addWidget(self.scanOrder, 1)
+        scan_order_lay.addWidget(self.scanFly)
+        scan_order_lay.addWidget(self.scanEstimate, 2)
+
         self.scanProgress = QProgressBar(self)
         # self.scanProgress.setGeometry(0, 0, 300, 25)
         self.scanProgress.setMaximum(100)
@@ -267,6 +289,7 @@ class ScanModuleUI(QWidget):
 
         scan_ctrl_lay = QVBoxLayout(scan_ctrl_group)
         scan_ctrl_lay.setContentsMargins(0, 16, 0, 0)
+        scan_ctrl_lay.addWidget(scan_order_group)
         scan_ctrl_lay.addWidget(self.scanProgress)
         scan_ctrl_lay.addSpacing(10)
         scan_ctrl_lay.addWidget(scan_buttons_group)
@@ -0,0 +1,236 @@
+import math
+
+import numpy as np
+
+
+class ScanPlan(object):
+    # Precomputed scan trajectory built from the 'Map setup' rows.
+    # grid - integer index of every point along each scan dimension, shape (points, dims);
+    # points - offsets from the scan origin (stage or monochromator steps), same shape.
+    # The first row is the outermost dimension, the last one is scanned fastest.
+    # subset - explicit list of grid indices to visit (e.g. picked map points), None for the whole grid.
+
+    LEGEND = ('X', 'Y', 'Z', 'WL')
+
+    ORDERS = ('raster', 'serpentine', 'hilbert', 'nearest')
+
+    def __init__(self, scan_set, subset=None):
+        rows = [r for r in scan_set if r['id'] > 0 and r['count'] > 0]
+
+        self.axes = [self.LEGEND[r['id'] - 1] for r in rows]
+        self.counts = [r['count'] for r in rows]
+        self.steps = np.array([r['step'] for r in rows], dtype=np.int64)
+        # without scan dimensions there is only the current position to scan
+        if subset is None or not self.counts:
+            self.subset = None
+        else:
+            self.subset = np.asarray(subset, dtype=np.int64).reshape(len(subset), len(self.counts))
+
+        # no scan dimensions - actions are performed once at the current position
+        self.grid = self.raster_grid()
+        self.points = self.grid * self.steps
+
+    def set_order(self, order):
+        # reorders the trajectory, the set of points stays the same
+        self.grid = self.raster_grid()
+        if order == 'serpentine':
+            self.grid = self.serpentine_grid()
+        elif order == 'hilbert':
+            self.grid = self.grid[self.hilbert_order()]
+        elif order == 'nearest':
+            # every serpentine move is already a single step, so a greedy tour through the whole grid
+            # cannot be shorter - it only pays off for a subset of points
+            if self.subset is None:
+                self.grid = self.serpentine_grid()
+            else:
+                self.grid = self.grid[self.nearest_order()]
+
+        self.points = self.grid * self.steps
+
+    def raster_grid(self):
+        if self.subset is not None:
+            return self.subset[np.lexsort(self.subset.T[::-1])]
+        elif self.counts:
+            return np.indices(self.counts).reshape(len(self.counts), -1).T
+        else:
+            return np.zeros((1, 0), dtype=np.int64)
+
+    def serpentine_grid(self):
+        # every dimension runs backwards when the raster index of the outer dimensions is odd,
+        # so each line starts where the previous one ended
+        if not self.counts:
+            return self.raster_grid()
+
+        grid = np.indices(self.counts).reshape(len(self.counts), -1).T
+        snake = grid.copy()
+        for j in range(1, len(self.counts)):
+            outer = np.ravel_multi_index(grid[:, :j].T, self.counts[:j])
+            odd = outer % 2 == 1
+            snake[odd, j] = self.counts[j] - 1 - grid[odd, j]
+
+        if self.subset is None:
+            return snake
+
+        # a subset is visited in the order its points take along the whole grid serpentine
+        rank = np.empty(len(snake), dtype=np.int64)
+        rank[np.ravel_multi_index(snake.T, self.counts)] = np.arange(len(snake))
+        sub = self.raster_grid()
+        return sub[np.argsort(rank[np.ravel_multi_index(sub.T, self.counts)], kind='stable')]
+
+    def hilbert_order(self):
+        # Hilbert curve over the first two (map) dimensions, the inner dimensions keep raster order
+        if len(self.counts) < 2:
+            return np.arange(len(self))
+
+        n = 1 << int(math.ceil(math.log2(max(self.counts[0], self.counts[1], 2))))
+        x = self.grid[:, 0].copy()
+        y = self.grid[:, 1].copy()
+        d = np.zeros(len(x), dtype=np.int64)
+        s = n // 2
+        while s > 0:
+            rx = (x & s) > 0
+            ry = (y & s) > 0
+            d += s * s * ((3 * rx) ^ ry)
+            # rotate the quadrant
+            flip = ~ry & rx
+            x[flip] = s - 1 - x[flip]
+            y[flip] = s - 1 - y[flip]
+            swap = ~ry
+            x[swap], y[swap] = y[swap], x[swap].copy()
+            s //= 2
+
+        return np.argsort(d, kind='stable')
+
+    def nearest_order(self):
+        # greedy nearest-neighbour tour through the points, starting at the scan origin.
+        # Unvisited points are marked on the grid, so every lookup only searches a box around
+        # the current point, doubled until it holds one: all points in a box of half-width
+        # radius / step are within the radius, the ones outside are farther
+        if len(self) <= 1 or not self.counts:
+            return np.arange(len(self))
+
+        counts = np.array(self.counts)
+        steps = np.abs(self.steps)
+        index = np.full(self.counts, -1, dtype=np.int64)
+        index[tuple(self.grid.T)] = np.arange(len(self))
+        left = index >= 0
+        unit = steps[steps > 0].min() if np.any(steps > 0) else 1
+
+        order = np.empty(len(self), dtype=np.int64)
+        current = np.zeros(len(counts), dtype=np.int64)
+        for i in range(len(self)):
+            radius = unit
+            while True:
+                # axes without a step are searched whole
+                half = np.where(steps > 0, radius // np.maximum(steps, 1), counts)
+                lo = np.maximum(current - half, 0)
+                found = np.argwhere(left[tuple(slice(a, b) for a, b in zip(lo, current + half + 1))])
+                if len(found):
+                    break
+                radius *= 2
+
+            # argwhere keeps the raster order, ties go to the first point as in a full search
+            found += lo
+            current = found[np.argmin((np.abs(found - current) * steps).max(axis=1))]
+            left[tuple(current)] = False
+            order[i] = index[tuple(current)]
+
+        return order
+
+    def estimate(self, step_size, velocity, acceleration):
+        # Stage travel (um) per axis and the total motion time (sec) for the trajectory, including
+        # the way back to the origin. step_size - um per stage step, velocity - um/s, acceleration - um/s^2.
+        # Axes move simultaneously, so every move lasts as long as its slowest axis.
+        stage = [j for j, axis in enumerate(self.axes) if axis != 'WL']
+        pts = self.points[:, stage] * step_size
+        path = np.vstack((np.zeros((1, len(stage))), pts, np.zeros((1, len(stage)))))
+        dist = np.abs(np.diff(path, axis=0))
+
+        # trapezoidal velocity profile, triangular for short moves
+        ramp = velocity * velocity / acceleration
+        t = np.where(dist < ramp, 2 * np.sqrt(dist / acceleration), dist / velocity + velocity / acceleration)
+        t[dist == 0] = 0
+
+        travel = {}
+        for j, axis in zip(stage, dist.T):
+            travel[self.axes[j]] = travel.get(self.axes[j], 0) + float(axis.sum())
+
+        return {
+            'travel': travel,
+            'time': float(t.max(axis=1).sum()) if len(stage) else 0.0
+        }
+
+    def can_fly(self):
+        # continuous motion is possible along a stage axis scanned fastest
+        # over whole lines only
+        return self.subset is None and len(self.axes) > 0 and self.axes[-1] != 'WL' and self.counts[-1] > 1
+
+    def lines(self):
+        # plan rows grouped by lines of the fastest dimension, in trajectory order
+        outer = self.grid[:, :-1]
+        breaks = np.nonzero(np.any(np.diff(outer, axis=0) != 0, axis=1))[0] + 1
+        return np.split(np.arange(len(self)), breaks)
+
+    def __len__(self):
+        return self.grid.shape[0]
+
+    def map_shape(self):
+        # scan map image is drawn over the first two dimensions
+        if len(self.counts) >= 2:
+            return self.counts[0], self.counts[1]
+        elif len(self.counts) == 1:
+            return 1, self.counts[0]
+        else:
+            return 1, 1
+
+    def map_index(self, idx):
+        g = self.grid[idx]
+        if len(g) >= 2:
+            return g[0], g[1]
+        elif len(g) == 1:
+            return 0, g[0]
+        else:
+            return 0, 0
+
+    def map_point(self, row, col):
+        # scan index of a map image pixel, inner dimensions at their first position
+        rows, cols = self.map_shape()
+        if not (0 <= row < rows and 0 <= col < cols):
+            return None
+
+        dims = len(self.counts)
+        if dims >= 2:
+            index = (row, col) + (0,) * (dims - 2)
+        elif dims == 1:
+            index = (col,)
+        else:
+            index = ()
+
+        if all(0 <= i < c for i, c in zip(index, self.counts)):
+            return index
+        return None
+
+    def map_subset(self, pixels):
+        # grid indices of the given map pixels (row, col), inner dimensions in full
+        outer = sorted({self.map_point(r, c)[:2] for r, c in pixels if self.map_point(r, c) is not None})
+        outer = np.array(outer, dtype=np.int64).reshape(len(outer), min(len(self.counts), 2))
+        if len(self.counts) > 2:
+            inner = np.indices(self.counts[2:]).reshape(len(self.counts) - 2, -1).T
+        else:
+            inner = np.zeros((1, 0), dtype=np.int64)
+
+        return np.hstack((np.repeat(outer, len(inner), axis=0), np.tile(inner, (len(outer), 1))))
+
+    def moves(self, prev_point, point):
+        # relative stage moves between two consecutive points and the monochromator offset
+        # from the scan origin (None if the point does not change the monochromator position)
+        stage = {}
+        wl = None
+        for axis, delta, offset in zip(self.axes, point - prev_point, point):
+            if axis == 'WL':
+                if delta != 0:
+                    wl = int(offset)
+            elif delta != 0:
+                stage[axis] = stage.get(axis, 0) + int(delta)
+
+        return stage, wl
@@ -0,0 +1,453 @@
+import os
+import pty
+import tty
+import time
+import select
+from collections import namedtuple
+from threading import Thread, Timer, Lock, Event
+from concurrent.futures import Future
+
+import numpy as np
+import cv2
+
+
+TAcqTimings = namedtuple('TAcqTimings', ['exposure', 'accum', 'kinetic'])
+
+
+class SimAndorError(Exception):
+    pass
+
+
+class SimAndorCamera(object):
+    # Synthetic Andor CCD with the subset of the pylablib AndorSDK2Camera interface used by AndorCCD.
+    # Frames are the ccd-frame2_bw.png template scaled by the exposure, with Poisson shot noise,
+    # bias and gaussian read noise. Frame timing follows the acquisition settings: every frame is
+    # ready after its exposure (accumulations included) and the readout of all pixels at the
+    # selected horizontal shift speed.
+
+    Error = SimAndorError
+
+    # horizontal shift speeds (Hz), vertical shift speeds (us per row)
+    HS_SPEEDS = (3E6, 1E6, 0.05E6)
+    VS_SPEEDS = (8.25, 16.25, 32.25, 64.25)
+
+    def __init__(self, conf):
+        self.height = conf['CCD-h']
+        self.width = conf['CCD-w']
+
+        template = cv2.imread('ccd-frame2_bw.png')
+        if template is None:
+            template = np.zeros((self.height, self.width, 3))
+        template = np.dot(template[..., :3], [0.2989, 0.5870, 0.1140])
+        template = cv2.resize(template, (self.width, self.height))
+        # photoelectrons per second
+        self.signal = template / max(template.max(), 1) * conf['simSignal']
+        self.bias = conf['simBias']
+        self.readNoise = conf['simReadNoise']
+
+        self.opened = True
+        self.rng = np.random.default_rng()
+
+        self.exposure = 0.1
+        self.mode = 'single'
+        self.series = 1
+        self.accum = 1
+        self.accumCycle = 0
+        self.kineticCycle = 0
+        self.hsspeed = 0
+        self.vsspeed = 0
+
+        self.cooler = False
+        self.setpoint = -20
+        self.t_ambient = 20.0
+        self.temperature = 20.0
+        self.t_updated = time.perf_counter()
+
+        self.t_start = None
+        self.read = 0
+        self.pending = None
+        self.stopped = Event()
+
+    def is_opened(self):
+        return self.opened
+
+    def close(self):
+        self.stop_acquisition()
+        self.opened = False
+
+    def get_device_info(self):
+        return ('Simulator', 'SIM', 0, 0)
+
+    # --- acquisition settings ---
+
+    def set_exposure(self, exposure):
+        self.exposure = max(float(exposure), 1E-5)
+        return self.exposure
+
+    def get_exposure(self):
+        return self.exposure
+
+    def setup_shutter(self, mode, *args, **kwargs):
+        pass
+
+    def set_acquisition_mode(self, mode, setup_params=True):
+        self.mode = mode
+        if mode == 'single':
+            self.series = 1
+            self.accum = 1
+        return mode
+
+    def setup_accum_mode(self, num_acc, cycle_time_acc=0):
+        self.set_acquisition_mode('accum')
+        self.series = 1
+        self.accum = num_acc
+        self.accumCycle = cycle_time_acc
+
+    def setup_kinetic_mode(self, num_cycle, cycle_time=0., num_acc=1, cycle_time_acc=0, num_prescan=0):
+        self.set_acquisition_mode('kinetic')
+        self.series = num_cycle
+        self.kineticCycle = cycle_time
+        self.accum = num_acc
+        self.accumCycle = cycle_time_acc
+
+    def setup_fast_kinetic_mode(self, num_acc, cycle_time_acc=0.):
+        self.set_acquisition_mode('fast_kinetic')
+        self.series = num_acc
+        self.accum = 1
+        self.kineticCycle = cycle_time_acc
+
+    def setup_cont_mode(self, cycle_time=0):
+        self.set_acquisition_mode('cont')
+        self.series = 0
+        self.accum = 1
+        self.kineticCycle = cycle_time
+
+    def set_trigger_mode(self, mode):
+        return mode
+
+    def set_read_mode(self, mode):
+        return mode
+
+    def set_amp_mode(self, channel=None, oamp=None, hsspeed=None, preamp=None):
+        if hsspeed is not None:
+            self.hsspeed = hsspeed
+
+    def get_hsspeed_frequency(self, hsspeed=None):
+        return self.HS_SPEEDS[self.hsspeed if hsspeed is None else hsspeed]
+
+    def set_vsspeed(self, vsspeed):
+        self.vsspeed = vsspeed
+
+    def readout_time(self):
+        return self.height * (self.VS_SPEEDS[self.vsspeed] * 1E-6 + self.width / self.get_hsspeed_frequency())
+
+    def get_frame_timings(self):
+        readout = self.readout_time()
+        accum = max(self.accumCycle, self.exposure + readout)
+        kinetic = max(self.kineticCycle, (self.accum - 1) * accum + self.exposure + readout)
+        return TAcqTimings(self.exposure, accum, kinetic)
+
+    # --- acquisition ---
+
+    def start_acquisition(self):
+        self.stopped.clear()
+        self.t_start = time.perf_counter()
+        self.read = 0
+
+    def stop_acquisition(self):
+        self.stopped.set()
+        self.t_start = None
+
+    def frame_ready_time(self, n):
+        timings = self.get_frame_timings()
+        return (self.t_start + n * timings.kinetic + (self.accum - 1) * timings.accum +
+                self.exposure + self.readout_time())
+
+    def wait_for_frame(self, since='lastread', nframes=1, timeout=20.):
+        if self.t_start is None:
+            raise self.Error('Acquisition is not running')
+        if self.series and self.read >= self.series:
+            raise self.Error('No more frames in the series')
+
+        # the frame is synthesized while the simulated camera is still exposing and reading out
+        ready = self.frame_ready_time(self.read)
+        self.pending = self.make_frame()
+
+        delay = ready - time.perf_counter()
+        if delay > timeout:
+            self.stopped.wait(timeout)
+            raise self.Error('Frame timeout')
+        if self.stopped.wait(max(delay, 0)):
+            raise self.Error('Acquisition stopped')
+
+    def read_oldest_image(self):
+        self.read += 1
+        frame, self.pending = self.pending, None
+        return frame if frame is not None else self.make_frame()
+
+    def make_frame(self):
+        exposure = self.exposure * self.accum
+        frame = self.rng.poisson(self.signal * exposure).astype(np.float64)
+        frame += self.bias * self.accum + self.rng.normal(0, self.readNoise * np.sqrt(self.accum), frame.shape)
+
+        return np.clip(frame, 0, 65535).astype(np.uint16)
+
+    # --- cooling: the sensor approaches the setpoint (cooler on) or the ambient temperature at 1 C/s ---
+
+    def update_temperature(self):
+        t = time.perf_counter()
+        target = self.setpoint if self.cooler else self.t_ambient
+        step = t - self.t_updated
+        self.temperature += float(np.clip(target - self.temperature, -step, step))
+        self.t_updated = t
+
+    def set_temperature(self, temperature, enable_cooler=True):
+        self.update_temperature()
+        self.setpoint = temperature
+        if enable_cooler:
+            self.cooler = True
+
+    def get_temperature_setpoint(self):
+        return self.setpoint
+
+    def get_temperature_range(self):
+        return -100, 20
+
+    def get_temperature(self):
+        self.update_temperature()
+        return self.temperature
+
+    def get_temperature_status(self):
+        self.update_temperature()
+        if not self.cooler:
+            return 'off'
+        elif abs(self.temperature - self.setpoint) > 1:
+            return 'not_reached'
+        else:
+            return 'stabilized'
+
+    def set_cooler(self, on=True):
+        self.update_temperature()
+        self.cooler = on
+
+
+class MonoSimulator(Thread):
+    # MDR-3 controller emulator on a pseudo terminal: MonoDriver opens self.port like the USB serial
+    # device. Speaks the DS/DM/GP/GA/G+/G-/G0 protocol, the grating turns at a constant speed (steps/s).
+
+    def __init__(self, speed, position=0):
+        super().__init__(daemon=True)
+
+        self.speed = speed
+        self.p0 = position
+        self.target = position
+        self.t0 = time.perf_counter()
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.stop_event = Event()
+        self.start()
+
+    def position(self):
+        travel = self.speed * (time.perf_counter() - self.t0)
+        if travel >= abs(self.target - self.p0):
+            return self.target
+        return int(self.p0 + np.sign(self.target - self.p0) * travel)
+
+    def goto(self, pos):
+        if self.position() != self.target:
+            return 'BUSY'
+
+        self.p0 = self.target
+        # limit switch at zero
+        self.target = max(int(pos), 0)
+        self.t0 = time.perf_counter()
+        return 'OK'
+
+    def reply(self, cmd):
+        try:
+            if cmd == 'DS':
+                return 'OK' if self.position() == self.target else 'BUSY'
+            elif cmd == 'DM':
+                return 'Monochromator controller, #SIM'
+            elif cmd == 'GP':
+                return str(self.position())
+            elif cmd.startswith('GA'):
+                return self.goto(int(cmd[2:]))
+            elif cmd.startswith('G+'):
+                return self.goto(self.position() + int(cmd[2:]))
+            elif cmd.startswith('G-'):
+                return self.goto(self.position() - int(cmd[2:]))
+            elif cmd == 'G0':
+                return self.goto(0)
+        except ValueError:
+            pass
+
+        return 'ERROR'
+
+    def run(self):
+        buf = b''
+        while not self.stop_event.is_set():
+            if not select.select([self.master], [], [], 0.1)[0]:
+                continue
+            try:
+                buf += os.read(self.master, 1024)
+            except OSError:
+                break
+
+            while b'\n' in buf:
+                line, buf = buf.split(b'\n', 1)
+                cmd = line.decode('utf-8', errors='replace').strip()
+                if cmd:
+                    os.write(self.master, (self.reply(cmd) + '\r\n').encode())
+
+    def stop(self):
+        self.stop_event.set()
+        self.join(1.0)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class SimStage(object):
+    # Virtual KCube stage with the CubeController interface. Moves follow a trapezoidal velocity
+    # profile (triangular for short moves) with the configured velocity and acceleration;
+    # the position is computed from the elapsed time, move futures complete on a timer.
+
+    def __init__(self, conf):
+        # um per device unit
+        self.step = conf['stageStep']
+        # mm/s, mm/s^2
+        self.velocity = conf['stageVelocity'] / 1000
+        self.acceleration = conf['stageAcceleration'] / 1000
+
+        self.lock = Lock()
+        self.origin = 0.0
+        self.distance = 0.0
+        self.t_start = 0.0
+        self.duration = 0.0
+        self.v = 0.0
+        self.a = 1.0
+        self.timer = None
+        self.futures = []
+
+    def travelled(self, t):
+        # distance (device units) covered t seconds after the move start
+        d = abs(self.distance)
+        if t >= self.duration:
+            return d
+
+        t_acc = self.v / self.a
+        if d < self.v * t_acc:
+            t_acc = self.duration / 2
+            if t < t_acc:
+                return self.a * t * t / 2
+            return d - self.a * (self.duration - t) ** 2 / 2
+        elif t < t_acc:
+            return self.a * t * t / 2
+        elif t < self.duration - t_acc:
+            return self.v * (t - t_acc / 2)
+        else:
+            return d - self.a * (self.duration - t) ** 2 / 2
+
+    def counter(self):
+        t = time.perf_counter() - self.t_start
+        return self.origin + np.sign(self.distance) * self.travelled(t)
+
+    def move_steps(self, distance):
+        with self.lock:
+            self.origin = self.counter()
+            self.distance = float(distance)
+            self.t_start = time.perf_counter()
+
+            # profile in device units
+            self.v = self.velocity * 1000 / self.step
+            self.a = self.acceleration * 1000 / self.step
+            d = abs(self.distance)
+            if d < self.v * self.v / self.a:
+                self.duration = 2 * np.sqrt(d / self.a)
+            else:
+                self.duration = d / self.v + self.v / self.a
+
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = Timer(self.duration, self.finish, args=(self.t_start,))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def move_to(self, position):
+        # position in mm
+        self.move_steps(position * 1000 / self.step - self.counter())
+
+    def finish(self, t_start):
+        with self.lock:
+            if t_start != self.t_start:
+                return
+            futures = self.futures
+            self.futures = []
+
+        for future in futures:
+            future.set_result(self.position)
+
+    def move_steps_async(self, distance):
+        self.move_steps(distance)
+        return self.move_future()
+
+    def move_to_async(self, position):
+        self.move_to(position)
+        return self.move_future()
+
+    def move_future(self):
+        future = Future()
+        with self.lock:
+            moving = self.is_moving
+            if moving:
+                self.futures.append(future)
+        if not moving:
+            future.set_result(self.position)
+
+        return future
+
+    def home(self):
+        self.move_steps(-self.counter())
+
+    def get_position(self):
+        return float(self.counter() * self.step / 1000)
+
+    def stop(self):
+        with self.lock:
+            self.origin = self.counter()
+            self.distance = 0.0
+            self.duration = 0.0
+            self.t_start = time.perf_counter()
+            if self.timer is not None:
+                self.timer.cancel()
+            futures = self.futures
+            self.futures = []
+
+        for future in futures:
+            future.set_result(self.position)
+
+    def shutdown(self):
+        self.stop()
+
+    def get_velocity_params(self):
+        return self.velocity, self.acceleration
+
+    def set_velocity_params(self, velocity, acceleration):
+        self.velocity = velocity
+        self.acceleration = acceleration
+
+    def get_position_counter(self):
+        return int(round(self.counter()))
+
+    def get_is_jogging(self):
+        return False
+
+    def get_is_moving(self):
+        return time.perf_counter() - self.t_start < self.duration
+
+    position = property(get_position, None, None)
+    is_jogging = property(get_is_jogging, None, None)
+    is_moving = property(get_is_moving, None, None)
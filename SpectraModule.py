@@ -1,13 +1,23 @@
+import os
 import time
 from functools import partial
 from math import ceil
 from threading import Thread, Event
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
 
 from PyQt5.QtCore import Qt, QThread, QRunnable, QThreadPool, QMutex, QEventLoop, QTimer, pyqtSignal, pyqtSlot, QObject
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QDoubleValidator
 
 from SpectraModuleUI import SpectraModuleUI, SetTemperatureWindow
+from HardWareOrchestrator import OrchestratorBridge
+from DataWriter import DataWriter
+from SpectrumCube import SpectrumCube, RowBinning
+import Instrumentation as instr
 
 import numpy as np
+import pyqtgraph as pg
 
 
 class SpectraModule(SpectraModuleUI):
@@ -16,15 +26,22 @@ class SpectraModule(SpectraModuleUI):
 
     spectrumAcquired = pyqtSignal()
 
+    stripAcquired = pyqtSignal(int)
+
     statusDataUpdated = pyqtSignal(dict)
 
-    def __init__(self, cam_wi, ccd, hardware, hardware_conf, p_set, status_bar):
+    acquisitionTimings = pyqtSignal(dict)
+
+    def __init__(self, cam_wi, ccd, hardware, orchestrator, hardware_conf, p_set, status_bar):
         super().__init__(cam_wi, hardware_conf)
 
         self.statusBar = status_bar
         self.paramSet = p_set
         self.hardware = hardware
         self.ccd = ccd
+        self.orchestrator = orchestrator
+        self.hwBridge = OrchestratorBridge(orchestrator)
+        self.hwBridge.errorOccurred.connect(self.statusBar.showMessage)
 
         self.tSettings = SetTemperatureWindow(self.ccd)
 
@@ -34,12 +51,35 @@ class SpectraModule(SpectraModuleUI):
         self.spWidth = self.ccdWidth
 
         # frame data array and coordinates, default coordinates as pixel number
-        self.spData = np.zeros((self.ccdHeight, self.ccdWidth), dtype=np.uint16)
-        self.coordinates = np.arange(self.spWidth, dtype=np.float)
+        # spData is the displayed frame: the acquired spectrum or a scan point
+        self.spCube = SpectrumCube(self.ccdHeight, self.ccdWidth, directory=self.paramSet['dataPath'])
+        self.rowSums = RowBinning()
+        self.set_frame(self.spCube.frame())
+        self.coordinates = np.arange(self.spWidth, dtype=np.float64)
         self.n_factor = 1
+        self.scanFrameShown = False
+        self.spectrumY = np.zeros(self.spWidth)
+
+        # progressive display: strips stitched since the last redraw are drawn once per screen refresh
+        self.stripItems = []
+        self.stripLevels = None
+        self.pendingStrips = set()
+        refresh_interval = int(1000 / (QApplication.primaryScreen().refreshRate() or 60))
+        self.stripTimer = QTimer(self)
+        self.stripTimer.setSingleShot(True)
+        self.stripTimer.setInterval(refresh_interval)
+        self.stripTimer.timeout.connect(self.show_strips)
+
+        # cursor drags are coalesced into one plot update per screen refresh
+        self.cursorTimer = QTimer(self)
+        self.cursorTimer.setSingleShot(True)
+        self.cursorTimer.setInterval(refresh_interval)
+        self.cursorTimer.timeout.connect(self.cursor_update)
 
         self.mono_positions = [None]*self.paramSet['MDR-3']['WL-inc']
 
+        self.dataWriter = DataWriter()
+
         self.thread_pool = QThreadPool()
         self.mutex = QMutex()
         # self.thread_pool.setMaxThreadCount(3)
@@ -48,9 +88,6 @@ class SpectraModule(SpectraModuleUI):
         self.spectrumCmp.set_frame_size(self.spData, self.ccdWidth, self.spectraOverlap)
         self.spectrumCmp.setAutoDelete(False)
 
-        self.monoChkState = MonoChkState(self)
-        self.monoChkState.setAutoDelete(False)
-
         self.statusUpdateThread = StatusUpdate(self)
         self.statusUpdateThread.start()
 
@@ -58,6 +95,7 @@ class SpectraModule(SpectraModuleUI):
         # self.spectrumAcquisition.setArr()
         # print(self.framedata[1,1])
 
+        self.update_wl_limits()
         self.connect_events()
         self.init_parameters(self.paramSet)
 
@@ -71,7 +109,9 @@ class SpectraModule(SpectraModuleUI):
         self.stop_move.clicked.connect(self.stage_stop)
 
         self.acquire_btn.clicked.connect(self.acquire)
+        self.saveSpectra.toggled.connect(self.save_spectra_change)
         self.spectrumAcquired.connect(self.show_spectrum)
+        self.stripAcquired.connect(self.strip_acquired)
 
         self.step_val.currentTextChanged.connect(self.stepinfo_change)
 
@@ -79,6 +119,7 @@ class SpectraModule(SpectraModuleUI):
         self.WLStart.editingFinished.connect(self.WL_start_change)
         self.WLEnd_dec.clicked.connect(self.WL_end_dec)
         self.WLEnd_inc.clicked.connect(self.WL_end_inc)
+        self.WLEnd.editingFinished.connect(self.WL_end_change)
         self.monoSetPos.clicked.connect(self.mono_centralWL_set)
         self.monoGridSelect.currentIndexChanged.connect(self.mono_grid_select)
         self.monoStartup.connect(self.startup)
@@ -114,29 +155,34 @@ class SpectraModule(SpectraModuleUI):
         self.tSet.clicked.connect(self.show_tsettings)
 
         self.statusDataUpdated.connect(self.update_satatus_data)
+        self.acquisitionTimings.connect(self.show_timings)
 
     def ccd_vline_pos(self, e):
         column = ceil(e.getXPos())
         self.paramSet['frameSet']['column'] = column
-        self.upd_frame_section(column - 1)
+        self.cursorTimer.start()
         self.frameColSelect.setValue(column)
 
     def ccd_hline_pos(self, e):
         row = ceil(e.getYPos())
         self.paramSet['frameSet']['row'] = row
-        self.upd_spectrum(row - 1)
+        self.cursorTimer.start()
         self.frameRowSelect.setValue(row)
 
     def ccd_col_select(self, val):
         self.paramSet['frameSet']['column'] = val
-        self.upd_frame_section(val - 1)
+        self.cursorTimer.start()
         self.vLine.setPos([val, 0])
 
     def ccd_row_select(self, val):
         self.paramSet['frameSet']['row'] = val
-        self.upd_spectrum(val)
+        self.cursorTimer.start()
         self.hLine.setPos([0, val])
 
+    def cursor_update(self):
+        self.upd_spectrum()
+        self.upd_frame_section()
+
     def spectrum_cursor_pos(self, e):
         # pos = (e.x(), e.y())
         pos = e
@@ -162,32 +208,24 @@ class SpectraModule(SpectraModuleUI):
         units_id = self.XUnits.checkedId()
         self.paramSet['frameSet']['x-axis'] = units_id
 
-        strip_size = self.ccdWidth - self.spectraOverlap
+        # the axis is built for the acquired spectrum
+        if self.scanFrameShown:
+            self.set_frame(self.spCube.frame())
+            self.scanFrameShown = False
+
         if units_id == 0:
             # nm
-            for i, p in enumerate(self.mono_positions):
-                offset_idx = i*strip_size
-                for n in range(strip_size):
-                    self.coordinates[offset_idx + n] = self.hardware.mono_toWL(p, n)
-            for n in range(strip_size, self.ccdWidth):
-                self.coordinates[offset_idx + n] = self.hardware.mono_toWL(p, n)
-
+            self.coordinates = self.stitched_axis('nm')
             self.spectrum.plotItem.setLabels(bottom='Wavelength (nm)')
 
         elif units_id == 1:
             # eV
-            for i, p in enumerate(self.mono_positions):
-                offset_idx = i*strip_size
-                for n in range(strip_size):
-                    self.coordinates[offset_idx + n] = 1239.84193 / self.hardware.mono_toWL(p, n)
-            for n in range(strip_size, self.ccdWidth):
-                self.coordinates[offset_idx + n] = 1239.84193 / self.hardware.mono_toWL(p, n)
-
+            self.coordinates = self.stitched_axis('eV')
             self.spectrum.plotItem.setLabels(bottom='Energy (eV)')
 
         else:
             # pixel number
-            self.coordinates = np.arange(self.spWidth, dtype=np.float)
+            self.coordinates = np.arange(self.spWidth, dtype=np.float64)
             self.spectrum.plotItem.setLabels(bottom='Pixel number')
 
         self.upd_spectrum()
@@ -200,6 +238,13 @@ class SpectraModule(SpectraModuleUI):
             spectrum_vb.setXRange(self.coordinates[self.spWidth-1], self.coordinates[0], padding=0.02)
             # spectrum_vb.setLimits(xMin=self.coordinates[self.spWidth-1], xMax=self.coordinates[0])
 
+    def stitched_axis(self, units='nm'):
+        # axis of the stitched spectrum assembled from the cached per-strip axes
+        strip_size = self.ccdWidth - self.spectraOverlap
+        axes = [self.hardware.strip_axis(p, units) for p in self.mono_positions]
+
+        return np.concatenate([a[:strip_size] for a in axes] + [axes[-1][strip_size:]])
+
     def y_units_change(self):
         units_id = self.YUnits.checkedId()
         self.paramSet['frameSet']['y-axis'] = units_id
@@ -215,50 +260,43 @@ class SpectraModule(SpectraModuleUI):
         if row == -1:
             row = self.paramSet['frameSet']['row'] - 1
 
+        self.spectrumY = self.spectrum_data(row)
+        self.spectrum.lod.set_data(self.coordinates, self.spectrumY)
+
+    def spectrum_data(self, row, columns=slice(None)):
+        # binned spectrum of the displayed frame for the given column range
         bin_rows = self.paramSet['frameSet']['binning']
 
         if bin_rows > 1:
             min_row = ceil(row - bin_rows / 2)
             max_row = ceil(row + bin_rows / 2)
-
-            if self.paramSet['frameSet']['binningAvg']:
-                self.spectrum.curve.setData(
-                    x=self.coordinates,
-                    y=np.average(self.spData[min_row:max_row, :], axis=0) * self.n_factor
-                )
-            else:
-                self.spectrum.curve.setData(
-                    x=self.coordinates,
-                    y=np.sum(self.spData[min_row:max_row, :], axis=0) * self.n_factor
-                )
+            y = self.rowSums.rows(min_row, max_row, columns, self.paramSet['frameSet']['binningAvg'])
         else:
-            self.spectrum.curve.setData(
-                x=self.coordinates,
-                y=self.spData[row, :] * self.n_factor
-            )
+            y = np.asarray(self.spData[row, columns], dtype=np.float64)
+
+        return y * self.n_factor
+
+    def set_frame(self, data):
+        # displayed frame, the binning table is rebuilt once per frame
+        self.spData = data
+        self.rowSums.build(data)
 
     def upd_frame_section(self, column=-1):
         if column == -1:
             column = self.frameColSelect.value() - 1
 
-        self.frameSection.curve.setData(x=self.spData[:, column], y=np.arange(self.ccdHeight))
+        column = min(column, self.spData.shape[1] - 1)
+        self.frameSection.lod.set_data(np.arange(self.ccdHeight), self.spData[:, column])
 
     def resize_spectrum(self, pcs, keep_previous=False):
         # resizing spectrum data array
         self.spWidth = (self.ccdWidth - self.spectraOverlap) * pcs + self.spectraOverlap
 
-        previous_data = self.spData
-        previous_data_width = self.spData.shape[1]
-        self.spData = np.zeros((self.ccdHeight, self.spWidth), dtype=np.uint16)
-        if keep_previous:
-            if previous_data_width < self.spData.shape[1]:
-                self.spData[:, 0:previous_data_width] = previous_data
-            else:
-                data_width = self.spData.shape[1]
-                self.spData = previous_data[:, 0:data_width]
+        self.spCube.resize(self.spWidth, keep_previous)
+        self.set_frame(self.spCube.frame())
 
         self.spectrumCmp.set_frame_size(self.spData, self.ccdWidth, self.spectraOverlap)
-        self.coordinates = np.arange(self.spWidth, dtype=np.float)
+        self.coordinates = np.arange(self.spWidth, dtype=np.float64)
         self.x_units_change()
 
         # updating all widget sizes
@@ -271,74 +309,84 @@ class SpectraModule(SpectraModuleUI):
         self.paramSet['MDR-3']['WL-start'] = WL_start
 
         # updating monochromator positions
-        self.mono_positions[0] = self.hardware.mono_toSteps(WL_start)
-        if self.paramSet['MDR-3']['WL-inc'] > 1:
-            for i in range(1, self.paramSet['MDR-3']['WL-inc']):
-                WL_next = self.hardware.mono_toWL(self.mono_positions[i-1], self.ccdWidth - self.spectraOverlap)
-                steps_next = self.hardware.mono_toSteps(WL_next)
-                self.mono_positions[i] = steps_next
-        WL_end = self.hardware.mono_toWL(self.mono_positions[-1], self.ccdWidth)
-        self.WLEnd.setText("{0:.2f}".format(WL_end))
+        self.update_range(self.hardware.plan_strip_positions(
+            WL_start, overlap_px=self.spectraOverlap, strips=self.paramSet['MDR-3']['WL-inc']), False)
 
-        self.resize_spectrum(self.paramSet['MDR-3']['WL-inc'], False)
-        self.spectrumCmp.set_range_points(self.mono_positions)
+    def update_wl_limits(self):
+        # the end wavelength can not go past the peak of the grating model
+        self.WLEnd.setValidator(QDoubleValidator(200.0, self.hardware.mono_max_WL(self.ccdWidth), 2))
 
-    def WL_end_inc(self):
-        WL_inc = self.hardware.mono_toWL(self.mono_positions[-1], self.ccdWidth - self.spectraOverlap)
-        steps_inc = self.hardware.mono_toSteps(WL_inc)
-        self.mono_positions.append(steps_inc)
-        self.paramSet['MDR-3']['WL-inc'] += 1
+    def WL_end_change(self):
+        if not self.WLEnd.isModified():
+            return
 
-        WL_end = self.hardware.mono_toWL(steps_inc, self.ccdWidth)
-        self.WLEnd.setText("{0:.2f}".format(WL_end))
+        try:
+            WL_end = float(self.WLEnd.text())
+        except ValueError:
+            WL_end = 0
 
-        self.resize_spectrum(self.paramSet['MDR-3']['WL-inc'], True)
-        self.spectrumCmp.set_range_points(self.mono_positions)
+        if WL_end > self.paramSet['MDR-3']['WL-start']:
+            self.update_range(self.hardware.plan_strip_positions(
+                self.paramSet['MDR-3']['WL-start'], WL_end, self.spectraOverlap), True)
+        else:
+            self.WLEnd.setText("{0:.2f}".format(self.hardware.mono_toWL(self.mono_positions[-1], self.ccdWidth)))
+
+    def WL_end_inc(self):
+        self.update_range(self.hardware.plan_strip_positions(
+            self.paramSet['MDR-3']['WL-start'], overlap_px=self.spectraOverlap,
+            strips=self.paramSet['MDR-3']['WL-inc'] + 1), True)
 
     def WL_end_dec(self):
         if self.paramSet['MDR-3']['WL-inc'] > 1:
-            self.mono_positions.pop()
-            self.paramSet['MDR-3']['WL-inc'] -= 1
+            self.update_range(self.hardware.plan_strip_positions(
+                self.paramSet['MDR-3']['WL-start'], overlap_px=self.spectraOverlap,
+                strips=self.paramSet['MDR-3']['WL-inc'] - 1), True)
 
-            WL_end = self.hardware.mono_toWL(self.mono_positions[-1], self.ccdWidth)
-            self.WLEnd.setText("{0:.2f}".format(WL_end))
+    def update_range(self, plan, keep_previous):
+        positions, axes, WL_end = plan
 
-            self.resize_spectrum(self.paramSet['MDR-3']['WL-inc'], True)
-            self.spectrumCmp.set_range_points(self.mono_positions)
+        self.mono_positions = positions
+        self.paramSet['MDR-3']['WL-inc'] = len(positions)
+        self.WLEnd.setText("{0:.2f}".format(WL_end))
 
+        self.resize_spectrum(self.paramSet['MDR-3']['WL-inc'], keep_previous)
+        self.spectrumCmp.set_range_points(self.mono_positions)
+
+    # Monochromator commands from the GUI run on the orchestrator, results come back to the callbacks
     def mono_centralWL_set(self):
         # Position (in steps) is calculated according to the first pixel, WL - to the center pixel
-        WL_set = self.monoGridPos.value()
-        pos_cp = self.hardware.mono_toSteps(WL_set)
-        WL_fp = WL_set - (self.hardware.mono_toWLC(pos_cp) - WL_set)
-        pos_set = self.hardware.mono_toSteps(WL_fp)
-        ret = self.hardware.mono_goto(pos_set)
-        if ret == 'OK':
-            self.thread_pool.start(self.monoChkState)
+        progress = self.hwBridge.notifier(self.show_mono_pos)
+        self.hwBridge.run(self.orchestrator.goto_wavelength(self.monoGridPos.value(), progress), self.mono_moved)
 
     def startup(self):
         self.WL_start_change()
         self.resize_spectrum(self.paramSet['MDR-3']['WL-inc'])
 
         # Check current monochromator position
-        current_pos = self.hardware.mono_pos()
-        if current_pos is not False:
-            current_WL = self.hardware.mono_toWLC(current_pos)
-            self.paramSet['MDR-3']['WL-pos'] = current_WL
-            self.monoCurrentPos.setText("{0:.2f}".format(current_WL) + ' nm')
-        else:
-            self.monoCurrentPos.setText(" -- ")
-            self.statusBar.showMessage('Monochromator position error...')
+        self.hwBridge.run(self.orchestrator.mono_position(), self.show_mono_pos)
 
     def mono_calibration(self):
-        ans = self.hardware.mono_move_start()
+        progress = self.hwBridge.notifier(self.show_mono_pos)
+        self.hwBridge.run(self.orchestrator.mono_home(progress), self.mono_moved)
+
+    def mono_moved(self, result):
+        ans, pos = result
         if ans == 'OK':
-            self.thread_pool.start(self.monoChkState)
+            self.show_mono_pos(pos)
         elif ans == 'BUSY':
             self.statusBar.showMessage('Monochromator is busy. Please try again later.')
         else:
             self.statusBar.showMessage('Monochromator connection error...')
 
+    def show_mono_pos(self, pos):
+        if pos is not False:
+            current_WL = self.hardware.mono_toWLC(pos)
+            self.paramSet['MDR-3']['WL-pos'] = current_WL
+            self.monoCurrentPos.setText("{0:.2f}".format(current_WL) + ' nm')
+        else:
+            self.monoCurrentPos.setText(" -- ")
+            self.statusBar.showMessage('Monochromator position error...')
+
     def mono_grid_select(self, grid_idx):
         self.paramSet['MDR-3']['grating-select'] = grid_idx
 
@@ -427,19 +475,134 @@ class SpectraModule(SpectraModuleUI):
         for axis in ('X', 'Y', 'Z'):
             self.hardware.stage_stop(axis)
 
-        for axis in ('X', 'Y', 'Z'):
-            pos = self.hardware.get_stage_position(axis)
+        # positions are read once the stages have settled, without blocking the GUI thread
+        self.hwBridge.run(self.orchestrator.wait_idle(('X', 'Y', 'Z')), self.stage_stopped)
+
+    def stage_stopped(self, positions):
+        for axis, pos, pos_item in zip(('X', 'Y', 'Z'), positions, (self.x_pos, self.y_pos, self.z_pos)):
             self.paramSet['stagePos'][axis] = pos
-            self.x_pos.setText(str(pos))
+            pos_item.setText(str(pos))
 
     def show_spectrum(self):
+        # queued signal delivery from the acquisition thread
+        instr.record('qt.spectrumAcquired', time.perf_counter() - self.spectrumCmp.emitted)
+
+        with instr.span('render.spectrum'):
+            if self.scanFrameShown:
+                self.x_units_change()
+            else:
+                self.rowSums.build(self.spData)
+
+            with instr.span('render.setImage'):
+                self.CCDFrame.image.setImage(self.spData)
+            self.upd_spectrum()
+            self.upd_frame_section()
+
+        self.stripTimer.stop()
+        self.pendingStrips.clear()
+        for item in self.stripItems:
+            item.clear()
+
+    def strip_acquired(self, strip_idx):
+        self.pendingStrips.add(strip_idx)
+        if not self.stripTimer.isActive():
+            self.stripTimer.start()
+
+    def show_strips(self):
+        # Redraws only the column ranges of the new strips: every strip has its own image item placed
+        # over the spectrum image, and only its slice of the spectrum curve is recomputed.
+        # The full image is uploaded once, when the acquisition is over.
+        if self.scanFrameShown or len(self.spectrumY) != self.spWidth:
+            self.pendingStrips.clear()
+            return
+
+        with instr.span('render.strips'):
+            self.draw_strips()
+
+    def draw_strips(self):
+        strips = sorted(self.pendingStrips)
+        self.pendingStrips.clear()
+        if strips[0] == 0:
+            self.stripLevels = None
+
+        row = self.paramSet['frameSet']['row'] - 1
+        levels = self.stripLevels
+        for strip_idx in strips:
+            idx1, idx2 = self.spectrumCmp.strip_columns(strip_idx)
+            data = self.spData[:, idx1:idx2]
+
+            while len(self.stripItems) <= strip_idx:
+                item = pg.ImageItem()
+                self.CCDFrame.vb.addItem(item)
+                self.stripItems.append(item)
+            item = self.stripItems[strip_idx]
+            item.setImage(data, autoLevels=False, levels=levels or (0, 1))
+            item.setPos(idx1, 0)
+
+            low, high = float(data.min()), float(data.max())
+            if levels is None:
+                levels = (low, high)
+            else:
+                levels = (min(levels[0], low), max(levels[1], high))
+
+            self.rowSums.update(self.spData, slice(idx1, idx2))
+            self.spectrumY[idx1:idx2] = self.spectrum_data(row, slice(idx1, idx2))
+            self.spectrum.lod.update_values(idx1, idx2, self.spectrumY[idx1:idx2])
+
+        # the display range grows with the data, earlier strips are rescaled only when it changes
+        if levels != self.stripLevels:
+            self.stripLevels = levels
+            for item in self.stripItems:
+                if item.image is not None:
+                    item.setLevels(levels)
+
+        self.spectrum.lod.update()
+
+    def show_frame(self, data, axis):
+        # frame of a scan cube, shown until the next acquisition or x units change
+        self.set_frame(data)
+        self.coordinates = axis
+        self.scanFrameShown = True
         self.CCDFrame.image.setImage(self.spData)
         self.upd_spectrum()
         self.upd_frame_section()
 
-    def acquire(self):
+    def save_spectra_change(self, is_checked):
+        self.paramSet['saveSpectra'] = is_checked
+
+    def acquire(self, save=True):
+        if self.spectrumCmp.active.is_set():
+            return
+
+        # strips are streamed to <dataPath>/spectrum-<date>-<time>.h5
+        if save and self.paramSet['saveSpectra']:
+            path = os.path.join(self.paramSet['dataPath'] or os.getcwd(),
+                                time.strftime('spectrum-%Y%m%d-%H%M%S.h5'))
+            self.spectrumCmp.saving = self.dataWriter.open(path, self.paramSet)
+        else:
+            self.spectrumCmp.saving = False
+
+        # set before the runnable starts, so a second call cannot queue it again
+        self.spectrumCmp.active.set()
+        self.spectrumCmp.done.clear()
         self.thread_pool.start(self.spectrumCmp)
 
+    def acquire_wait(self, timeout=None):
+        # blocking acquisition for the scan worker thread, data is saved by the scan
+        self.acquire(False)
+        return self.spectrumCmp.done.wait(timeout)
+
+    def show_timings(self, timings):
+        # summary of the last stitched acquisition, the per-strip breakdown only while timing is enabled
+        exposure = sum(t['exposure'] for t in timings['strips'])
+        if instr.enabled:
+            for t in timings['strips']:
+                print('Strip {strip}: move {move:.3f} s, exposure {exposure:.3f} s, readout {readout:.3f} s, '
+                      'stitch {stitch:.3f} s'.format(**t))
+
+        self.statusBar.showMessage('Spectrum acquired in {0:.2f} s, dead time {1:.2f} s'.format(
+            timings['total'], timings['total'] - exposure))
+
     def update_satatus_data(self, statuses):
         # CCD cooling status
         if statuses['ccd_cooling'] in ['not_reached', 'not_stabilized']:
@@ -476,7 +639,6 @@ class SpectraModule(SpectraModuleUI):
 
     def stop_threads(self):
         self.spectrumCmp.stop()
-        self.monoChkState.stop()
 
         if self.ccd.get_temperature() < -10:
             self.camShutdownProgress.setWindowModality(Qt.WindowModal)
@@ -521,45 +683,11 @@ class StatusUpdate (QThread):
             time.sleep(0.5)
 
 
-class MonoChkState(QRunnable):
-
-    stop_event = Event()
-
-    def __init__(self, spectra_module):
-        super().__init__()
-
-        self.spModule = spectra_module
-
-    def stop(self):
-        if not self.stop_event.is_set():
-            self.stop_event.set()
-
-    def run(self):
-        while not self.stop_event.is_set():
-            time.sleep(0.5)
-            self.spModule.mutex.lock()
-            current_pos = self.spModule.hardware.mono_pos()
-            if current_pos is not False:
-                current_WL = self.spModule.hardware.mono_toWLC(current_pos)
-                self.spModule.paramSet['MDR-3']['WL-pos'] = current_WL
-                self.spModule.mainform.monoCurrentPos.setText("{0:.2f}".format(current_WL) + ' nm')
-            else:
-                self.spModule.mainform.monoCurrentPos.setText(" -- ")
-
-            status = self.spModule.hardware.mono_status()
-            self.spModule.mutex.unlock()
-            if status == 'OK':
-                break
-            elif status == 'ERROR':
-                self.spModule.mainform.statusBar.showMessage('Monochromator position check error...')
-                break
-
-        return
-
-
 class SpectrumCompilation(QRunnable):
+    # Stitched spectrum acquisition. Strips are pipelined: the grating moves to the next position
+    # while the CCD is reading out, and the previous strip is stitched on a worker thread while
+    # the next one is exposed.
 
-    frame_parsed = Event()
     stop_event = Event()
 
     mono_positions = []
@@ -568,63 +696,161 @@ class SpectrumCompilation(QRunnable):
     sp_size = 1024
     sp_overlap = 80
 
-    frame_index = 0
-
     def __init__(self, spectra_module):
         super().__init__()
 
         self.spModule = spectra_module
 
-        self.spModule.ccd.frameAcquired.connect(self.framedata_handler)
+        self.frames = Queue()
+        self.saving = False
+        self.emitted = 0.0
+        self.active = Event()
+        self.done = Event()
+        self.timings = []
+
+        # slot indices are only queued here, so the handler runs directly in the FrameProvider thread
+        self.spModule.ccd.frameAcquired.connect(self.framedata_handler, Qt.DirectConnection)
 
     def set_range_points(self, p):
         self.mono_positions = p
 
-    # def setArr(self):
-    #     self.dataArray[1,1] = 5
-
     def set_frame_size(self, data_array, strip_size, overlap):
         self.dataArray = data_array
         self.sp_size = strip_size
         self.sp_overlap = overlap
 
-    def framedata_handler(self, data):
-        idx1 = self.frame_index * (self.sp_size - self.sp_overlap)
-        idx2 = self.frame_index * (self.sp_size - self.sp_overlap) + self.sp_size
-        self.dataArray[:, idx1:idx2] = data
-        self.frame_index += 1
+    def framedata_handler(self, slot):
+        if self.active.is_set():
+            self.spModule.ccd.claim_frame(slot)
+            self.frames.put((slot, time.perf_counter()))
+
+    def strip_columns(self, strip_idx):
+        idx1 = strip_idx * (self.sp_size - self.sp_overlap)
+        return idx1, idx1 + self.sp_size
+
+    def stitch(self, strip_idx, slot, timing):
+        t = time.perf_counter()
+
+        idx1, idx2 = self.strip_columns(strip_idx)
+        self.dataArray[:, idx1:idx2] = self.spModule.ccd.frame_data(slot)
+        self.spModule.ccd.release_frame(slot)
+
+        if self.saving:
+            pos = self.mono_positions[strip_idx]
+            self.spModule.dataWriter.write_strip(
+                self.dataArray[:, idx1:idx2], self.spModule.hardware.strip_axis(pos), pos)
+
+        timing['stitch'] = time.perf_counter() - t
+        for stage in ('move', 'exposure', 'readout', 'stitch'):
+            instr.record('strip.' + stage, timing[stage])
+        self.spModule.stripAcquired.emit(strip_idx)
+
+    def drop_frames(self):
+        while not self.frames.empty():
+            self.spModule.ccd.release_frame(self.frames.get()[0])
+
+    def end_series(self):
+        ccd = self.spModule.ccd
+        ccd.stop_acquisition()
+        ccd.wait_idle(ccd.frame_timeout())
+        self.drop_frames()
 
-        self.frame_parsed.set()
+    def mono_goto(self, pos):
+        self.spModule.mutex.lock()
+        ret = self.spModule.hardware.mono_goto(pos)
+        self.spModule.mutex.unlock()
+
+        # BUSY, ERROR or no reply - the grating does not go to the strip position
+        if ret != 'OK':
+            print('Monochromator: move to {0} failed ({1})'.format(pos, ret))
+            return False
+
+        return True
+
+    def mono_wait(self):
+        while not self.stop_event.is_set():
+            self.spModule.mutex.lock()
+            status = self.spModule.hardware.mono_status()
+            self.spModule.mutex.unlock()
+            if status == 'OK':
+                return True
+            elif status == 'ERROR' or status is False:
+                return False
+
+            time.sleep(0.05)
+
+        return False
 
     def stop(self):
         if not self.stop_event.is_set():
             self.stop_event.set()
 
     def run(self):
-        while not self.stop_event.is_set():
-            for pos in self.mono_positions:
-                # self.spModule.mutex.lock()
-                # self.spModule.hardware.mono_goto(pos)
-                # self.spModule.thread_pool.start(self.spModule.monoChkState)
-                # self.spModule.mutex.unlock()
-                #
-                # while True:
-                #     self.spModule.mutex.lock()
-                #     status = self.spModule.hardware.mono_status()
-                #     self.spModule.mutex.unlock()
-                #     if status == 'OK':
-                #         break
-                #
-                #     time.sleep(0.5)
-
-                self.spModule.ccd.frame()
-                self.frame_parsed.wait()
-                self.frame_parsed.clear()
-
-            self.frame_index = 0
+        ccd = self.spModule.ccd
+        use_mono = self.spModule.hardware.monoStatus
 
+        while not self.stop_event.is_set():
+            self.timings = []
+
+            # the executor is per acquisition, so a stopped one never outlives its strips
+            stitch_pool = ThreadPoolExecutor(max_workers=1)
+
+            # frames left over from an interrupted acquisition
+            self.drop_frames()
+
+            if self.saving:
+                self.spModule.mutex.lock()
+                self.spModule.dataWriter.write_positions('spectrum', self.spModule.hardware.positions())
+                self.spModule.mutex.unlock()
+
+            moved = not use_mono or self.mono_goto(self.mono_positions[0])
+
+            t_start = time.perf_counter()
+            for i in range(len(self.mono_positions)):
+                if self.stop_event.is_set() or not moved:
+                    break
+
+                timing = {'strip': i}
+                t0 = time.perf_counter()
+                if use_mono and not self.mono_wait():
+                    break
+
+                t1 = time.perf_counter()
+                ccd.frame()
+                ccd.wait_exposure(ccd.frame_timeout())
+
+                # the shutter is closed during readout, the grating can go to the next position
+                t2 = time.perf_counter()
+                if use_mono and i + 1 < len(self.mono_positions):
+                    moved = self.mono_goto(self.mono_positions[i + 1])
+
+                try:
+                    slot, t3 = self.frames.get(timeout=ccd.frame_timeout() + 1.0)
+                except Empty:
+                    break
+                finally:
+                    # a kinetic or continuous series keeps acquiring, only its first frame is the strip;
+                    # frames taken during the grating move must not be stitched as the next strip
+                    self.end_series()
+
+                timing['move'] = t1 - t0
+                timing['exposure'] = t2 - t1
+                timing['readout'] = t3 - t2
+                self.timings.append(timing)
+
+                stitch_pool.submit(self.stitch, i, slot, timing)
+
+            self.active.clear()
+            # waits for the strips still being stitched
+            stitch_pool.shutdown()
+            if self.saving:
+                self.spModule.dataWriter.close()
+            self.done.set()
+            self.emitted = time.perf_counter()
             self.spModule.spectrumAcquired.emit()
+            self.spModule.acquisitionTimings.emit({'total': time.perf_counter() - t_start, 'strips': self.timings})
 
             return
 
-        return
+        self.active.clear()
+        self.done.set()
@@ -4,7 +4,7 @@ from PyQt5.QtWidgets import (QWidget, QMainWindow, QFrame, QSplitter, QSizePolic
                              QHeaderView, QTabWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QAbstractItemView,
                              QProgressDialog)
 from PyQt5.QtCore import Qt, pyqtSignal, QRectF, QLineF, QPointF
-from PyQt5.QtGui import QIntValidator
+from PyQt5.QtGui import QIntValidator, QDoubleValidator
 import qdarkstyle
 
 import pyqtgraph as pg
@@ -43,6 +43,7 @@ class SpectraModuleUI(QWidget):
         self.monoStartup.emit()
 
         self.laserSelect.setCurrentIndex(laser['source-id'])
+        self.saveSpectra.setChecked(param_set['saveSpectra'])
 
         # Frame parameter set
         self.frameRowSelect.setValue(frame['row'])
@@ -200,6 +201,7 @@ class SpectraModuleUI(QWidget):
 
         self.acquire_btn = QPushButton('Acquire')
         self.acquire_btn.setFixedSize(120, 60)
+        self.saveSpectra = QCheckBox('Save to HDF5')
 
         stage_coordinates = QTableWidget(3, 1)
         stage_coordinates.setEditTriggers(QAbstractItemView.NoEditTriggers)
@@ -255,8 +257,9 @@ class SpectraModuleUI(QWidget):
         stage_pos_lay.addWidget(stage_coordinates, 0, 5, 4, 1)
 
         acquire_btns_group = QFrame(self)
-        acquire_btns_lay = QHBoxLayout(acquire_btns_group)
+        acquire_btns_lay = QVBoxLayout(acquire_btns_group)
         acquire_btns_lay.addWidget(self.acquire_btn)
+        acquire_btns_lay.addWidget(self.saveSpectra)
 
         action_btns_lay = QHBoxLayout(bottom_frame)
         action_btns_lay.addWidget(mono_control_group, 3)
@@ -272,6 +275,9 @@ class SpectraModuleUI(QWidget):
         self.CCDFrame.vb.setLimits(xMin=0, xMax=conf['CCD-w']-1, yMin=0, yMax=conf['CCD-h']-1)
         self.vLine = CrossLine(angle=90, bounds=(0.5, 1023.5))
         self.hLine = CrossLine(angle=0, bounds=(0.5, 255.5))
+        # cursors stay above the strip images drawn during acquisition
+        self.vLine.setZValue(10)
+        self.hLine.setZValue(10)
         self.CCDFrame.vb.addItem(self.vLine)
         self.CCDFrame.vb.addItem(self.hLine)
 
@@ -369,7 +375,7 @@ class SpectraModuleUI(QWidget):
         self.WLStart.setSingleStep(0.1)
         self.WLStart.setDecimals(1)
         self.WLEnd = QLineEdit(self)
-        self.WLEnd.setReadOnly(True)
+        self.WLEnd.setValidator(QDoubleValidator(200.0, 2000.0, 2))
         self.WLEnd_dec = QPushButton('<')
         self.WLEnd_inc = QPushButton('>')
         self.WLEnd_dec.setStyleSheet('QPushButton {min-width: 20px;}')
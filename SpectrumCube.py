@@ -0,0 +1,91 @@
+import tempfile
+
+import numpy as np
+
+
+class SpectrumCube(object):
+    # CCD data of a stitched spectrum or of a whole scan map, shape (*scan shape, height, width).
+    # The array is a memory map of a temporary file, so the OS pages it in and out as slices are read
+    # and maps larger than RAM can be acquired. All accessors return views, nothing is copied.
+    # index - position in the scan dimensions, () for a single spectrum.
+
+    def __init__(self, height, width, shape=(), dtype=np.uint16, axis=None, directory=None):
+        self.shape = tuple(int(s) for s in shape)
+        self.height = height
+        self.width = width
+        self.dtype = np.dtype(dtype)
+        self.directory = directory or None
+
+        # x axis of the stored frames (wavelength, energy or pixel number)
+        self.axis = np.arange(width, dtype=np.float64) if axis is None else np.asarray(axis)
+
+        self.data = self.allocate(self.shape + (height, width))
+
+    def allocate(self, shape):
+        # the file is unlinked on close, the mapping keeps it alive until the array is released;
+        # pages are zero-filled on first access, so an unused cube takes neither RAM nor disk
+        with tempfile.TemporaryFile(dir=self.directory) as f:
+            return np.memmap(f, dtype=self.dtype, mode='w+', shape=shape)
+
+    def resize(self, width, keep_previous=False):
+        previous = self.data
+        self.data = self.allocate(self.shape + (self.height, width))
+        if keep_previous:
+            w = min(width, self.width)
+            for index in np.ndindex(*self.shape):
+                self.data[index][:, :w] = previous[index][:, :w]
+
+        self.width = width
+        self.axis = np.arange(width, dtype=np.float64)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def frame(self, index=()):
+        return self.data[tuple(index)]
+
+    def rows(self, min_row, max_row, index=()):
+        return self.data[tuple(index)][min_row:max_row, :]
+
+    def column(self, column, index=()):
+        return self.data[tuple(index)][:, column]
+
+    def pixel_map(self, row, column):
+        # value of one CCD pixel over the scan dimensions
+        return self.data[..., row, column]
+
+    def put(self, index, frame):
+        self.data[tuple(index)][:, :frame.shape[1]] = frame
+
+
+class RowBinning(object):
+    # Column-wise prefix sums of a frame, sums[k] is the sum of the first k rows.
+    # The sum over any row range is one subtraction per column, whatever the number of binned rows.
+    # uint32 holds the sum of up to 65537 rows of 16-bit data.
+
+    def __init__(self):
+        self.sums = np.zeros((1, 0), dtype=np.uint32)
+
+    def build(self, frame):
+        h, w = frame.shape
+        if self.sums.shape != (h + 1, w):
+            self.sums = np.zeros((h + 1, w), dtype=np.uint32)
+
+        np.cumsum(frame, axis=0, dtype=np.uint32, out=self.sums[1:])
+
+    def update(self, frame, columns):
+        # only the given column range has changed
+        np.cumsum(frame[:, columns], axis=0, dtype=np.uint32, out=self.sums[1:, columns])
+
+    def rows(self, min_row, max_row, columns=slice(None), average=False):
+        height = self.sums.shape[0] - 1
+        min_row = min(max(min_row, 0), height)
+        max_row = min(max(max_row, min_row), height)
+
+        # prefix sums do not decrease down the rows, the unsigned difference can not wrap
+        y = (self.sums[max_row, columns] - self.sums[min_row, columns]).astype(np.float64)
+        if average and max_row > min_row:
+            y /= max_row - min_row
+
+        return y
@@ -0,0 +1,103 @@
+import sys
+import json
+import timeit
+import argparse
+from typing import Optional, Tuple
+
+from vimba.util import TraceEnable, RuntimeTypeCheckEnable
+from vimba.util.production import _set_production_mode
+
+
+# Per-call cost of the vimba decorators. Every public vimba call, including the frame handler path
+# (Camera.queue_frame, Frame getters, feature get/set), is wrapped in TraceEnable and
+# RuntimeTypeCheckEnable. Functions with the signatures of such calls are decorated in development
+# and in production mode (see vimba/util/production.py) and timed against the plain function.
+# Logging is disabled, as in normal operation.
+#
+#   python VimbaBench.py [--number N] [--repeat R] [--output result.json]
+
+
+class Frame(object):
+    pass
+
+
+class Target(object):
+
+    def queue_frame(self, frame: Frame):
+        pass
+
+    def get_frame(self, timeout_ms: int = 2000):
+        pass
+
+    def get_frame_stream(self, limit: Optional[int] = None, timeout_ms: int = 2000, pool_size: int = 3):
+        pass
+
+    def read_registers(self, addrs: Tuple[int, ...]):
+        pass
+
+
+# name: (function, call arguments)
+CALLS = {
+    'queue_frame': (Target.queue_frame, (Target(), Frame())),
+    'get_frame': (Target.get_frame, (Target(), 500)),
+    'get_frame_stream': (Target.get_frame_stream, (Target(), 10)),
+    'read_registers': (Target.read_registers, (Target(), (0x10, 0x14, 0x18, 0x1C))),
+}
+
+# typecheck: RuntimeTypeCheckEnable only, development: both decorators
+MODES = ('plain', 'typecheck', 'development', 'production')
+
+
+def decorate(func, mode):
+    if mode == 'plain':
+        return func
+
+    _set_production_mode(mode == 'production')
+    try:
+        if mode == 'typecheck':
+            return RuntimeTypeCheckEnable()(func)
+
+        return TraceEnable()(RuntimeTypeCheckEnable()(func))
+    finally:
+        _set_production_mode(None)
+
+
+def per_call(func, args, number, repeat):
+    # best of the repeats, sec per call
+    timer = timeit.Timer('func(*args)', globals={'func': func, 'args': args})
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(number, repeat):
+    results = {}
+    for name, (func, args) in CALLS.items():
+        times = {mode: per_call(decorate(func, mode), args, number, repeat) for mode in MODES}
+        times['saving'] = times['development'] - times['production']
+        results[name] = times
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-call cost of the vimba tracing and type check decorators')
+    parser.add_argument('--number', type=int, default=20000, help='calls per repeat')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='JSON result file')
+    args = parser.parse_args()
+
+    results = run(args.number, args.repeat)
+
+    print('{:<18}{:>12}{:>12}{:>14}{:>13}{:>10}'.format('call, ns', *MODES, 'saving'))
+    for name, times in results.items():
+        print('{:<18}{:>12.0f}{:>12.0f}{:>14.0f}{:>13.0f}{:>10.0f}'.format(
+            name, *(times[k] * 1E9 for k in MODES + ('saving',))))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,12 @@
-from PyQt5.QtWidgets import (QWidget, QTabBar, QSizePolicy)
-from PyQt5.QtCore import Qt, QRectF, QLineF, QPointF, QSize
+from PyQt5.QtWidgets import (QWidget, QTabBar, QSizePolicy, QDockWidget, QTableWidget, QTableWidgetItem,
+                             QHeaderView, QAbstractItemView, QCheckBox, QPushButton, QVBoxLayout, QHBoxLayout)
+from PyQt5.QtCore import Qt, QRectF, QLineF, QPointF, QSize, QTimer
 
+import numpy as np
 import pyqtgraph as pg
 
+import Instrumentation as instr
+
 
 class VTabBar(QTabBar):
     def __init__(self, parent=None):
@@ -43,6 +47,11 @@ class PgPlotWidget(pg.PlotWidget):
         self.curve = self.plot(pen='y')
         self.vb = self.plotItem.getViewBox()
 
+        # the column section is drawn along the vertical axis
+        self.lod = LodCurve(self.curve, self.vb, vertical=(w != 'row'))
+        self.vb.sigRangeChanged.connect(self.lod.update)
+        self.vb.sigResized.connect(self.lod.update)
+
         self.init_ui(w)
 
     def init_ui(self, w):
@@ -68,6 +77,164 @@ class PgPlotWidget(pg.PlotWidget):
             self.plotItem.getViewBox().invertX(True)
 
 
+class LodCurve(object):
+    # Level-of-detail curve. A min/max envelope pyramid of the data is built once, level k holds the
+    # minimum and maximum of every 2**k consecutive points. On every range change the level giving about
+    # one envelope pair per screen pixel is drawn, clipped to the visible range, so the number of points
+    # pushed to the curve depends on the plot size rather than on the data length, and peaks stay visible.
+    # pos - independent coordinate (monotonic), val - curve values.
+
+    def __init__(self, curve, vb, vertical=False):
+        self.curve = curve
+        self.vb = vb
+        self.vertical = vertical
+
+        self.pos = np.zeros(0)
+        self.mins = []
+        self.maxs = []
+        self.shown = None
+
+    def set_data(self, pos, val):
+        self.pos = np.asarray(pos, dtype=np.float64)
+        val = np.asarray(val, dtype=np.float64)
+
+        self.mins = [val]
+        self.maxs = [val]
+        while len(self.mins[-1]) > 1:
+            self.mins.append(self.reduce(self.mins[-1], np.minimum))
+            self.maxs.append(self.reduce(self.maxs[-1], np.maximum))
+
+        self.shown = None
+        self.update()
+
+    def update_values(self, idx1, idx2, val):
+        # new values of the points idx1..idx2, only the envelope blocks covering them are recomputed
+        self.mins[0][idx1:idx2] = val
+        for k in range(1, len(self.mins)):
+            b1 = idx1 >> k
+            b2 = ((idx2 - 1) >> k) + 1
+            self.mins[k][b1:b2] = self.reduce(self.mins[k - 1][2 * b1:2 * b2], np.minimum)
+            self.maxs[k][b1:b2] = self.reduce(self.maxs[k - 1][2 * b1:2 * b2], np.maximum)
+
+        # redrawn by the next update()
+        self.shown = None
+
+    @staticmethod
+    def reduce(data, func):
+        if len(data) % 2:
+            data = np.append(data, data[-1])
+        return func(data[0::2], data[1::2])
+
+    def visible(self):
+        # index range of the points in the view, one point beyond each edge
+        n = len(self.pos)
+        low, high = sorted(self.vb.viewRange()[1 if self.vertical else 0])
+        if self.pos[0] <= self.pos[-1]:
+            idx1 = np.searchsorted(self.pos, low)
+            idx2 = np.searchsorted(self.pos, high, side='right')
+        else:
+            rev = self.pos[::-1]
+            idx1 = n - np.searchsorted(rev, high, side='right')
+            idx2 = n - np.searchsorted(rev, low)
+
+        return max(int(idx1) - 1, 0), min(int(idx2) + 1, n)
+
+    def update(self):
+        n = len(self.pos)
+        if n == 0:
+            return
+
+        idx1, idx2 = self.visible()
+        pixels = max(self.vb.height() if self.vertical else self.vb.width(), 1.0)
+        k = int(np.ceil(np.log2(max((idx2 - idx1) / pixels, 1.0))))
+        k = min(k, len(self.mins) - 1)
+
+        b1 = idx1 >> k
+        b2 = max(((idx2 - 1) >> k) + 1, b1 + 1)
+        if self.shown == (k, b1, b2):
+            return
+        self.shown = (k, b1, b2)
+
+        if k == 0:
+            pos = self.pos[b1:b2]
+            val = self.mins[0][b1:b2]
+        else:
+            # every block is drawn as a vertical segment from its minimum to its maximum
+            pos = np.repeat(self.pos[b1 << k:b2 << k:1 << k], 2)
+            val = np.column_stack((self.mins[k][b1:b2], self.maxs[k][b1:b2])).ravel()
+
+        # the end points keep the full data extent for auto range, they are out of view
+        if b1 > 0:
+            pos = np.concatenate((self.pos[:1], pos))
+            val = np.concatenate((self.mins[0][:1], val))
+        if b2 << k < n:
+            pos = np.concatenate((pos, self.pos[-1:]))
+            val = np.concatenate((val, self.mins[0][-1:]))
+
+        with instr.span('render.setData'):
+            if self.vertical:
+                self.curve.setData(x=val, y=pos)
+            else:
+                self.curve.setData(x=pos, y=val)
+
+
+class StatsPanel(QDockWidget):
+    # Instrumentation spans: count, mean, percentiles and total time (ms), refreshed every second
+
+    COLUMNS = ('count', 'mean', 'p50', 'p90', 'p99', 'max', 'total')
+
+    def __init__(self, parent=None):
+        super().__init__('Timing statistics', parent)
+
+        widget = QWidget(self)
+
+        self.enabledChk = QCheckBox('Enabled')
+        self.enabledChk.setChecked(instr.enabled)
+        self.enabledChk.toggled.connect(instr.enable)
+        self.resetBtn = QPushButton('Reset')
+        self.resetBtn.clicked.connect(self.reset)
+        self.dumpBtn = QPushButton('Dump')
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+
+        buttons_lay = QHBoxLayout()
+        buttons_lay.addWidget(self.enabledChk)
+        buttons_lay.addStretch()
+        buttons_lay.addWidget(self.resetBtn)
+        buttons_lay.addWidget(self.dumpBtn)
+
+        lay = QVBoxLayout(widget)
+        lay.addLayout(buttons_lay)
+        lay.addWidget(self.table)
+        self.setWidget(widget)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+
+    def reset(self):
+        instr.reset()
+        self.refresh()
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+
+        spans = instr.snapshot()
+        self.table.setRowCount(len(spans))
+        self.table.setVerticalHeaderLabels(list(spans))
+        for row, stat in enumerate(spans.values()):
+            for col, key in enumerate(self.COLUMNS):
+                if key == 'count':
+                    text = str(stat[key])
+                else:
+                    text = '{0:.2f}'.format(stat[key] * 1000)
+                self.table.setItem(row, col, QTableWidgetItem(text))
+
+
 class CrossLine(pg.InfiniteLine):
     def __init__(self,  angle=0, bounds=(0, 1)):
 
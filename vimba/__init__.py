@@ -96,7 +96,9 @@ __all__ = [
 
     'TraceEnable',
     'ScopedLogEnable',
-    'RuntimeTypeCheckEnable'
+    'RuntimeTypeCheckEnable',
+    'PRODUCTION_MODE_ENV',
+    'is_production_mode'
 ]
 
 # Import everything exported from the top level module
@@ -123,4 +125,4 @@ from .util import Log, LogLevel, LogConfig, LOG_CONFIG_TRACE_CONSOLE_ONLY, \
                   LOG_CONFIG_WARNING_FILE_ONLY, LOG_CONFIG_WARNING, LOG_CONFIG_ERROR_CONSOLE_ONLY, \
                   LOG_CONFIG_ERROR_FILE_ONLY, LOG_CONFIG_ERROR, LOG_CONFIG_CRITICAL_CONSOLE_ONLY, \
                   LOG_CONFIG_CRITICAL_FILE_ONLY, LOG_CONFIG_CRITICAL, ScopedLogEnable, \
-                  TraceEnable, RuntimeTypeCheckEnable
+                  TraceEnable, RuntimeTypeCheckEnable, PRODUCTION_MODE_ENV, is_production_mode
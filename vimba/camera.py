@@ -26,9 +26,11 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import enum
+import math
 import os
 import copy
 import threading
+import collections
 
 from ctypes import POINTER
 from typing import Tuple, List, Callable, cast, Optional, Union, Dict
@@ -37,7 +39,7 @@ from .c_binding import VmbCameraInfo, VmbHandle, VmbUint32, G_VIMBA_C_HANDLE, Vm
                        VimbaCError, VmbError, VmbFrame, VmbFeaturePersist, VmbFeaturePersistSettings
 from .feature import discover_features, discover_feature, FeatureTypes, FeaturesTuple, \
                      FeatureTypeTypes
-from .shared import filter_features_by_name, filter_features_by_type, filter_affected_features, \
+from .shared import filter_features_by_type, filter_affected_features, \
                     filter_selected_features, filter_features_by_category, \
                     attach_feature_accessors, remove_feature_accessors, read_memory, \
                     write_memory, read_registers, write_registers
@@ -61,6 +63,14 @@ __all__ = [
 ]
 
 
+# Bounds of the automatically sized frame buffer count, see Camera.start_streaming()
+AUTO_BUFFER_MIN = 3
+AUTO_BUFFER_MAX = 64
+
+# Frame rate features in order of preference (AVT GigE, SFNC)
+FRAME_RATE_FEATURES = ('AcquisitionFrameRateAbs', 'AcquisitionFrameRate')
+
+
 # Type Forward declarations
 CameraChangeHandler = Callable[['Camera', 'CameraEvent'], None]
 CamerasTuple = Tuple['Camera', ...]
@@ -116,6 +126,7 @@ class _Context:
         self.cam = cam
         self.cam_handle = _cam_handle_accessor(cam)
         self.frames = frames
+        self.frames_by_buffer = {_frame_handle_accessor(f).buffer: f for f in frames}
         self.frames_lock = threading.Lock()
         self.frames_handler = handler
         self.frames_callback = callback
@@ -232,6 +243,17 @@ class _StateAcquiring(_State):
             except VimbaCError as e:
                 raise _build_camera_error(self.context.cam, e) from e
 
+    @TraceEnable()
+    def wait_for_frame(self, frame, timeout_ms: int):
+        frame_handle = _frame_handle_accessor(frame)
+
+        try:
+            call_vimba_c('VmbCaptureFrameWait', self.context.cam_handle, byref(frame_handle),
+                         timeout_ms)
+
+        except VimbaCError as e:
+            raise _build_camera_error(self.context.cam, e) from e
+
     @TraceEnable()
     def queue_frame(self, frame):
         frame_handle = _frame_handle_accessor(frame)
@@ -295,6 +317,11 @@ class _CaptureFsm:
         if isinstance(self.__state, _StateAcquiring):
             self.__state.wait_for_frames(timeout_ms)
 
+    def wait_for_frame(self, frame, timeout_ms: int):
+        # Wait for a single queued Frame only in AcquiringMode
+        if isinstance(self.__state, _StateAcquiring):
+            self.__state.wait_for_frame(frame, timeout_ms)
+
     def queue_frame(self, frame):
         # Queue Frame only in AcquiringMode
         if isinstance(self.__state, _StateAcquiring):
@@ -335,10 +362,122 @@ def _frame_generator(cam, limit: Optional[int], timeout_ms: int):
             raise exc
 
 
+class _FrameStream:
+    """Synchronous acquisition keeping the capture engine armed between frames.
+
+    Frames come from a preallocated pool and are returned without copy. A returned Frame
+    stays valid until it is handed back by release(), then its buffer is queued again.
+    Capturing mode is entered on the first frame and left by close() or on reaching the limit.
+    While capturing, the camera counts as streaming.
+    """
+    def __init__(self, cam, limit: Optional[int], timeout_ms: int, pool_size: int):
+        if cam.is_streaming():
+            raise VimbaCameraError('Operation not supported while streaming.')
+
+        self.__cam = cam
+        frame_data_size = cam.get_feature_by_name('PayloadSize').get()
+        self.__frames = tuple([Frame(frame_data_size) for _ in range(pool_size)])
+        self.__context = _Context(cam, self.__frames, None, None)
+        self.__fsm = _CaptureFsm(self.__context)
+        self.__queued = collections.deque()
+        self.__limit = limit
+        self.__timeout_ms = timeout_ms
+        self.__cnt = 0
+        self.__armed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    @TraceEnable()
+    def __next__(self) -> Frame:
+        if (self.__limit is not None) and (self.__cnt >= self.__limit):
+            self.close()
+            raise StopIteration
+
+        if not self.__armed:
+            self.__arm()
+
+        if not self.__queued:
+            raise VimbaCameraError('All frames of the pool are held. Release frames first.')
+
+        # The driver fills queued frames in order
+        frame = self.__queued.popleft()
+
+        try:
+            self.__fsm.wait_for_frame(frame, self.__timeout_ms)
+
+        except VimbaCameraError:
+            # Frame is still queued, keep its place
+            self.__queued.appendleft(frame)
+            raise
+
+        frame._frame.frameID = self.__cnt
+        self.__cnt += 1
+
+        return frame
+
+    @TraceEnable()
+    def release(self, frame: Frame):
+        """Hand a frame back to the pool. Releasing after close() returns silently.
+
+        Raises:
+            ValueError if the given frame is not from this stream.
+        """
+        if self.__context.frames_by_buffer.get(_frame_handle_accessor(frame).buffer) is not frame:
+            raise ValueError('Given Frame is not from this stream')
+
+        if not self.__armed or frame in self.__queued:
+            return
+
+        self.__fsm.queue_frame(frame)
+        self.__queued.append(frame)
+
+    @TraceEnable()
+    def close(self):
+        """Leave capturing mode. Frames already returned keep their data."""
+        if not self.__armed:
+            return
+
+        self.__armed = False
+        self.__queued.clear()
+
+        try:
+            exc = self.__fsm.leave_capturing_mode()
+            if exc:
+                raise exc
+
+        finally:
+            self.__cam._frame_stream = None
+
+    def __arm(self):
+        # Another stream may have been armed since this one was created
+        if self.__cam.is_streaming():
+            raise VimbaCameraError('Operation not supported while streaming.')
+
+        exc = self.__fsm.enter_capturing_mode()
+        if exc:
+            self.__fsm.leave_capturing_mode()
+            raise exc
+
+        self.__armed = True
+        self.__cam._frame_stream = self
+
+        for frame in self.__frames:
+            self.release(frame)
+
+
 class Camera:
     """This class allows access to a Camera detected by Vimba.
     Camera is meant be used in conjunction with the "with" - statement.
     On entering a context, all Camera features are detected and can be accessed within the context.
+    Features are indexed by name and stay valid until the last context is left. Feature info is
+    owned by the opened camera handle, so keep an outer context open to avoid rediscovery.
     Static Camera properties like Name and Model can be accessed outside the context.
     """
     @TraceEnable()
@@ -349,8 +488,10 @@ class Camera:
         self.__info: VmbCameraInfo = info
         self.__access_mode: AccessMode = AccessMode.Full
         self.__feats: FeaturesTuple = ()
+        self.__feats_by_name: Dict[str, FeatureTypes] = {}
         self.__context_cnt: int = 0
         self.__capture_fsm: Optional[_CaptureFsm] = None
+        self._frame_stream: Optional[_FrameStream] = None
         self._disconnected = False
 
     @TraceEnable()
@@ -603,13 +744,36 @@ class Camera:
             RuntimeError if called outside "with" - statement scope.
             VimbaFeatureError if no feature is associated with 'feat_name'.
         """
-        feat = filter_features_by_name(self.__feats, feat_name)
+        feat = self.__feats_by_name.get(feat_name)
 
         if not feat:
             raise VimbaFeatureError('Feature \'{}\' not found.'.format(feat_name))
 
         return feat
 
+    @TraceEnable()
+    @RaiseIfOutsideContext()
+    def set_features(self, features: Dict[str, object]):
+        """Set several camera features at once.
+
+        All features are looked up before the first write. Values are written in the
+        order given, e.g. {'ExposureAuto': 'Off', 'ExposureTimeAbs': 5000} disables
+        auto exposure before the exposure time is set.
+
+        Arguments:
+            features - Feature names mapped to the values to set.
+
+        Raises:
+            RuntimeError if called outside "with" - statement scope.
+            VimbaFeatureError if a feature name is unknown. No feature was written then.
+            VimbaFeatureError, TypeError or ValueError if a value could not be written.
+                              Features before it in 'features' are set.
+        """
+        feats = [(self.get_feature_by_name(name), value) for name, value in features.items()]
+
+        for feat, value in feats:
+            feat.set(value)
+
     @TraceEnable()
     @RaiseIfOutsideContext()
     @RuntimeTypeCheckEnable()
@@ -642,6 +806,53 @@ class Camera:
 
         return _frame_generator(self, limit, timeout_ms)
 
+    @TraceEnable()
+    @RaiseIfOutsideContext()
+    @RuntimeTypeCheckEnable()
+    def get_frame_stream(self, limit: Optional[int] = None, timeout_ms: int = 2000,
+                         pool_size: int = 3):
+        """Construct frame stream, providing synchronous image acquisition without copies.
+
+        Unlike the frame generator, capturing mode stays active across frames and no frame
+        is copied. Frames are taken from a pool of 'pool_size' buffers and must be handed back
+        with 'release()' once processed. Use the stream as context manager or call 'close()'
+        to leave capturing mode:
+
+            with cam.get_frame_stream(10) as stream:
+                for frame in stream:
+                    process(frame)
+                    stream.release(frame)
+
+        Arguments:
+            limit - The number of images the stream shall acquire. If limit is None,
+                    the stream produces images until it is closed.
+            timeout_ms - Timeout in milliseconds of frame acquisition.
+            pool_size - Number of frame buffers.
+
+        Returns:
+            Frame stream, an iterator over Frames
+
+        Raises:
+            TypeError if parameters do not match their type hint.
+            RuntimeError if called outside "with" - statement scope.
+            ValueError if a limit is supplied and negative.
+            ValueError if a timeout_ms is negative.
+            ValueError if pool_size is less or equal to zero.
+            VimbaTimeout if Frame acquisition timed out.
+            VimbaCameraError if Camera is streaming while constructing the stream.
+            VimbaCameraError if all frames of the pool are held on acquisition.
+        """
+        if limit and (limit < 0):
+            raise ValueError('Given Limit {} is not >= 0'.format(limit))
+
+        if timeout_ms <= 0:
+            raise ValueError('Given Timeout {} is not > 0'.format(timeout_ms))
+
+        if pool_size <= 0:
+            raise ValueError('Given pool_size {} must be positive'.format(pool_size))
+
+        return _FrameStream(self, limit, timeout_ms, pool_size)
+
     @TraceEnable()
     @RaiseIfOutsideContext()
     @RuntimeTypeCheckEnable()
@@ -660,12 +871,18 @@ class Camera:
             ValueError if a timeout_ms is negative.
             VimbaTimeout if Frame acquisition timed out.
         """
-        return next(self.get_frame_generator(1, timeout_ms))
+        if timeout_ms <= 0:
+            raise ValueError('Given Timeout {} is not > 0'.format(timeout_ms))
+
+        # The buffer is not reused after the stream is closed, the frame needs no copy
+        with _FrameStream(self, 1, timeout_ms, 1) as stream:
+            return next(stream)
 
     @TraceEnable()
     @RaiseIfOutsideContext()
     @RuntimeTypeCheckEnable()
-    def start_streaming(self, handler: FrameHandler, buffer_count: int = 5):
+    def start_streaming(self, handler: FrameHandler, buffer_count: Optional[int] = 5,
+                        handler_latency_ms: int = 100):
         """Enter streaming mode
 
         Enter streaming mode is also known as asynchronous frame acquisition.
@@ -674,19 +891,34 @@ class Camera:
 
         Arguments:
             handler - Callable that is executed on each acquired frame.
-            buffer_count - Number of frames supplied as internal buffer.
+            buffer_count - Number of frames supplied as internal buffer. If None, the number
+                           is sized to cover 'handler_latency_ms' at the current frame rate.
+            handler_latency_ms - Time a frame is expected to stay out of the buffer queue
+                                 (handler runtime plus the time a consumer holds it). Used
+                                 only if buffer_count is None.
 
         Raises:
             TypeError if parameters do not match their type hint.
             RuntimeError if called outside "with" - statement scope.
             ValueError if buffer is less or equal to zero.
+            ValueError if handler_latency_ms is negative.
             VimbaCameraError if the camera is already streaming.
             VimbaCameraError if anything went wrong on entering streaming mode.
         """
+        if buffer_count is None:
+            if handler_latency_ms < 0:
+                raise ValueError('Given handler_latency_ms {} must not be negative'.format(
+                                 handler_latency_ms))
+
+            buffer_count = self.__auto_buffer_count(handler_latency_ms)
+
         if buffer_count <= 0:
             raise ValueError('Given buffer_count {} must be positive'.format(buffer_count))
 
         if self.is_streaming():
+            if self._frame_stream is not None:
+                raise VimbaCameraError('Operation not supported while streaming.')
+
             raise VimbaCameraError('Camera \'{}\' already streaming.'.format(self.get_id()))
 
         # Setup capturing fsm
@@ -712,8 +944,8 @@ class Camera:
     def stop_streaming(self):
         """Leave streaming mode.
 
-        Leave asynchronous frame acquisition. If streaming mode was not activated before,
-        it just returns silently.
+        Leave asynchronous frame acquisition. A capturing frame stream is closed.
+        If streaming mode was not activated before, it just returns silently.
 
         Raises:
             RuntimeError if called outside "with" - statement scope.
@@ -722,6 +954,10 @@ class Camera:
         if not self.is_streaming():
             return
 
+        if self._frame_stream is not None:
+            self._frame_stream.close()
+            return
+
         # Leave Capturing mode. If any error occurs, report it and cleanup
         try:
             exc = self.__capture_fsm.leave_capturing_mode()
@@ -733,8 +969,10 @@ class Camera:
 
     @TraceEnable()
     def is_streaming(self) -> bool:
-        """Returns True if the camera is currently in streaming mode. If not, returns False."""
-        return self.__capture_fsm is not None and not self._disconnected
+        """Returns True if the camera is currently in streaming mode or a frame stream is capturing.
+        If not, returns False."""
+        busy = (self.__capture_fsm is not None) or (self._frame_stream is not None)
+        return busy and not self._disconnected
 
     @TraceEnable()
     @RaiseIfOutsideContext()
@@ -758,7 +996,8 @@ class Camera:
         if self.__capture_fsm is None:
             return
 
-        if frame not in self.__capture_fsm.get_context().frames:
+        buffer = _frame_handle_accessor(frame).buffer
+        if self.__capture_fsm.get_context().frames_by_buffer.get(buffer) is not frame:
             raise ValueError('Given Frame is not from Queue')
 
         self.__capture_fsm.queue_frame(frame)
@@ -907,10 +1146,11 @@ class Camera:
             raise exc from e
 
         self.__feats = discover_features(self.__handle)
+        self.__feats_by_name = {feat.get_name(): feat for feat in self.__feats}
         attach_feature_accessors(self, self.__feats)
 
         # Determine current PacketSize (GigE - only) is somewhere between 1500 bytes
-        feat = filter_features_by_name(self.__feats, 'GVSPPacketSize')
+        feat = self.__feats_by_name.get('GVSPPacketSize')
         if feat:
             try:
                 min_ = 1400
@@ -936,42 +1176,59 @@ class Camera:
 
         remove_feature_accessors(self, self.__feats)
         self.__feats = ()
+        self.__feats_by_name = {}
 
         call_vimba_c('VmbCameraClose', self.__handle)
         self.__handle = VmbHandle(0)
 
+    def __auto_buffer_count(self, handler_latency_ms: int) -> int:
+        # Frames arriving while one is held by the handler, plus one being filled and one spare.
+        fps = None
+
+        for name in FRAME_RATE_FEATURES:
+            feat = self.__feats_by_name.get(name)
+            if feat:
+                try:
+                    fps = feat.get()
+                    break
+
+                except VimbaFeatureError:
+                    pass
+
+        if not fps:
+            return 5
+
+        count = math.ceil(fps * handler_latency_ms / 1000) + 2
+        return min(max(count, AUTO_BUFFER_MIN), AUTO_BUFFER_MAX)
+
     def __frame_cb_wrapper(self, _: VmbHandle, raw_frame_ptr: VmbFrame):   # coverage: skip
         # Skip coverage because it can't be measured. This is called from C-Context.
 
         # ignore callback if camera has been disconnected
-        if self.__capture_fsm is None:
+        fsm = self.__capture_fsm
+        if fsm is None:
             return
 
-        context = self.__capture_fsm.get_context()
+        context = fsm.get_context()
 
+        # Frames are matched by their buffer address. The lock covers only the lookup, so the
+        # handler does not block other callbacks or queue_frame() of frames it handed out.
         with context.frames_lock:
-            raw_frame = raw_frame_ptr.contents
-            frame = None
+            frame = context.frames_by_buffer.get(raw_frame_ptr.contents.buffer)
 
-            for f in context.frames:
-                # Access Frame internals to compare if both point to the same buffer
-                if raw_frame.buffer == _frame_handle_accessor(f).buffer:
-                    frame = f
-                    break
+        # Execute registered handler
+        assert frame is not None
 
-            # Execute registered handler
-            assert frame is not None
-
-            try:
-                context.frames_handler(self, frame)
-
-            except Exception as e:
-                msg = 'Caught Exception in handler: '
-                msg += 'Type: {}, '.format(type(e))
-                msg += 'Value: {}, '.format(e)
-                msg += 'raised by: {}'.format(context.frames_handler)
-                Log.get_instance().error(msg)
-                raise e
+        try:
+            context.frames_handler(self, frame)
+
+        except Exception as e:
+            msg = 'Caught Exception in handler: '
+            msg += 'Type: {}, '.format(type(e))
+            msg += 'Value: {}, '.format(e)
+            msg += 'raised by: {}'.format(context.frames_handler)
+            Log.get_instance().error(msg)
+            raise e
 
 
 def _setup_network_discovery():
@@ -55,7 +55,11 @@ __all__ = [
     'EnterContextOnCall',
     'LeaveContextOnCall',
     'RaiseIfInsideContext',
-    'RaiseIfOutsideContext'
+    'RaiseIfOutsideContext',
+
+    # Production mode
+    'PRODUCTION_MODE_ENV',
+    'is_production_mode'
 ]
 
 from .log import Log, LogLevel, LogConfig, LOG_CONFIG_TRACE_CONSOLE_ONLY, \
@@ -65,6 +69,7 @@ from .log import Log, LogLevel, LogConfig, LOG_CONFIG_TRACE_CONSOLE_ONLY, \
                  LOG_CONFIG_ERROR_FILE_ONLY, LOG_CONFIG_ERROR, LOG_CONFIG_CRITICAL_CONSOLE_ONLY, \
                  LOG_CONFIG_CRITICAL_FILE_ONLY, LOG_CONFIG_CRITICAL
 
+from .production import PRODUCTION_MODE_ENV, is_production_mode
 from .tracer import TraceEnable
 from .scoped_log import ScopedLogEnable
 from .runtime_type_check import RuntimeTypeCheckEnable
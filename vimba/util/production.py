@@ -0,0 +1,69 @@
+"""BSD 2-Clause License
+
+Copyright (c) 2019, Allied Vision Technologies GmbH
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this
+   list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+   this list of conditions and the following disclaimer in the documentation
+   and/or other materials provided with the distribution.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+
+from typing import Optional
+
+
+__all__ = [
+    'PRODUCTION_MODE_ENV',
+    'is_production_mode'
+]
+
+
+# Environment variable enabling production mode, e.g. VIMBA_PY_PRODUCTION=1
+PRODUCTION_MODE_ENV: str = 'VIMBA_PY_PRODUCTION'
+
+# Read once on import, before any vimba function is decorated. Later changes of the
+# environment do not change the mode the library runs in.
+_import_mode: bool = os.environ.get(PRODUCTION_MODE_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+_override: Optional[bool] = None
+
+
+def is_production_mode() -> bool:
+    """Returns True if vimba was imported in production mode.
+
+    In production mode the decorators TraceEnable and RuntimeTypeCheckEnable return the
+    decorated function unchanged: no trace log entries are written and no argument types are
+    checked, calls cost the same as undecorated ones. Decorators are applied on import, so the
+    mode must be chosen before vimba is imported, by setting PRODUCTION_MODE_ENV to '1'.
+    """
+    return _import_mode
+
+
+def _decorate_for_production() -> bool:
+    # Mode for functions decorated now: the import mode unless overridden
+    return _import_mode if _override is None else _override
+
+
+def _set_production_mode(enable: Optional[bool]):
+    # Benchmark hook: decorate the following functions in the given mode, None restores the import
+    # mode. is_production_mode() keeps reporting the mode vimba itself was decorated in.
+    global _override
+    _override = enable
@@ -27,10 +27,11 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import collections
 
-from inspect import isfunction, ismethod, signature
+from inspect import isfunction, ismethod, signature, Parameter
 from functools import wraps
 from typing import get_type_hints, Union
 from .log import Log
+from .production import _decorate_for_production
 
 
 __all__ = [
@@ -38,6 +39,9 @@ __all__ = [
 ]
 
 
+_POSITIONAL = (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD)
+
+
 class RuntimeTypeCheckEnable:
     """Decorator adding runtime type checking to the wrapped callable.
 
@@ -46,38 +50,101 @@ class RuntimeTypeCheckEnable:
     arguments to not match a TypeError is raised.
     Note: This decorator is no replacement for a feature complete TypeChecker. It supports only
     a subset of all types expressible by type hints.
+    In production mode the callable is returned undecorated.
+    The signature is inspected on decoration. Type hints may contain forward references, they
+    are resolved on the first call and compiled into one checker per argument.
     """
     _log = Log.get_instance()
 
     def __call__(self, func):
+        if _decorate_for_production():
+            return func
+
+        sig = signature(func)
+        params = list(sig.parameters.values())
+
+        # Arguments can be looked up by position if there are no *args, keyword-only or **kwargs
+        by_position = all(p.kind in _POSITIONAL for p in params)
+        position = {p.name: i for i, p in enumerate(params)}
+        checks = None
+
+        def compile_checks():
+            hints = get_type_hints(func)
+            hints.pop('return', None)
+
+            return [(position[name], name, sig.parameters[name].default, self.__compile(hint), hint)
+                    for name, hint in hints.items()]
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            full_args, hints = self.__dismantle_sig(func, *args, **kwargs)
+            nonlocal checks
+            if checks is None:
+                checks = compile_checks()
+
+            if by_position:
+                n_args = len(args)
+                for index, arg_name, default, matches, hint in checks:
+                    if index < n_args:
+                        arg = args[index]
+
+                    elif arg_name in kwargs:
+                        arg = kwargs[arg_name]
 
-            for arg_name in hints:
-                self.__verify_arg(func, hints[arg_name], (arg_name, full_args[arg_name]))
+                    elif default is not Parameter.empty:
+                        arg = default
+
+                    else:
+                        # Missing argument, the call itself raises
+                        continue
+
+                    if not matches(arg):
+                        self.__raise(func, hint, arg_name)
+
+            else:
+                full_args = sig.bind(*args, **kwargs)
+                full_args.apply_defaults()
+                full_args = full_args.arguments
+
+                for _, arg_name, _, matches, hint in checks:
+                    if not matches(full_args[arg_name]):
+                        self.__raise(func, hint, arg_name)
 
             return func(*args, **kwargs)
 
         return wrapper
 
-    def __dismantle_sig(self, func, *args, **kwargs):
-        # Get merge args, kwargs and defaults to complete argument list.
-        full_args = signature(func).bind(*args, **kwargs)
-        full_args.apply_defaults()
+    def __compile(self, type_hint):
+        # Build a predicate equivalent to __matches(type_hint, arg). Plain classes, Unions
+        # (Optional) and Tuples get dedicated checks, anything else uses the generic matching.
+        origin = getattr(type_hint, '__origin__', None)
+
+        if isinstance(type_hint, type) and origin is None:
+            return lambda arg: type(arg) == type_hint
+
+        if origin == Union:
+            hints = type_hint.__args__
+
+            if all(isinstance(h, type) and getattr(h, '__origin__', None) is None for h in hints):
+                types = frozenset(hints)
+                return lambda arg: type(arg) in types
+
+            checks = tuple(self.__compile(h) for h in hints)
+            return lambda arg: any(check(arg) for check in checks)
 
-        # Get available type hints, remove return value.
-        hints = get_type_hints(func)
-        hints.pop('return', None)
+        if origin == tuple:
+            hints = type_hint.__args__
 
-        return (full_args.arguments, hints)
+            if Ellipsis in hints:
+                check = self.__compile(hints[0])
+                return lambda arg: type(arg) == tuple and all(check(v) for v in arg)
 
-    def __verify_arg(self, func, type_hint, arg_spec):
-        arg_name, arg = arg_spec
+            checks = tuple(self.__compile(h) for h in hints)
+            return lambda arg: type(arg) == tuple and (
+                arg == () or (len(arg) == len(checks) and all(c(v) for c, v in zip(checks, arg))))
 
-        if (self.__matches(type_hint, arg)):
-            return
+        return lambda arg: self.__matches(type_hint, arg)
 
+    def __raise(self, func, type_hint, arg_name):
         msg = '\'{}\' called with unexpected argument type. Argument\'{}\'. Expected type: {}.'
         msg = msg.format(func.__qualname__, arg_name, type_hint)
 
@@ -28,6 +28,7 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 from functools import reduce, wraps
 from inspect import signature
 from .log import Log
+from .production import _decorate_for_production
 
 
 __all__ = [
@@ -120,8 +121,12 @@ class TraceEnable:
     """Decorator: Adds an entry of LogLevel. Trace on entry and exit of the wrapped function.
     On exit, the log entry contains information if the function was left normally or with an
     exception.
+    In production mode the function is returned undecorated.
     """
     def __call__(self, func):
+        if _decorate_for_production():
+            return func
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             if _Tracer.is_log_enabled():
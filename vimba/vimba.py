@@ -39,7 +39,8 @@ from .interface import Interface, InterfaceChangeHandler, InterfaceEvent, Interf
 from .camera import Camera, CamerasList, CameraChangeHandler, CameraEvent, CamerasTuple, \
                     discover_cameras, discover_camera
 from .util import Log, LogConfig, TraceEnable, RuntimeTypeCheckEnable, EnterContextOnCall, \
-                  LeaveContextOnCall, RaiseIfInsideContext, RaiseIfOutsideContext
+                  LeaveContextOnCall, RaiseIfInsideContext, RaiseIfOutsideContext, \
+                  is_production_mode
 from .error import VimbaCameraError, VimbaInterfaceError, VimbaFeatureError
 from . import __version__ as VIMBA_PYTHON_VERSION
 
@@ -128,6 +129,15 @@ class Vimba:
             """Disable VimbaPython's logging mechanism."""
             Log.get_instance().disable()
 
+        def is_production_mode(self) -> bool:
+            """Returns True if VimbaPython was imported in production mode.
+
+            Production mode is selected by setting the environment variable
+            VIMBA_PY_PRODUCTION=1 before import, the mode is fixed from then on. Tracing and runtime type checks are compiled out, so
+            enable_log() reports no trace entries.
+            """
+            return is_production_mode()
+
         @TraceEnable()
         @RaiseIfOutsideContext()
         @RuntimeTypeCheckEnable()